@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app import http_clients
+
+logger = logging.getLogger("tubot.auth")
+
+# ========= Config =========
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_API_KEY = os.getenv("SUPABASE_API_KEY")
+# Secreto JWT del proyecto (tokens HS256)
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+# JWKS para claves asimétricas (RS256/ES256); necesita PyJWT[crypto]
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or (
+    f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None
+)
+JWT_AUDIENCE = os.getenv("JWT_AUDIENCE", "authenticated")
+JWKS_TTL = float(os.getenv("JWKS_TTL", "600"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Margen para diferencias de reloj al comprobar exp/nbf
+JWT_LEEWAY = 30
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class UnsupportedToken(Exception):
+    """El token no se puede verificar en local; hay que preguntar a Supabase."""
+
+
+# ========= Utilidades =========
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def sign_hs256(claims: dict, secret: str) -> str:
+    """Firma un JWT HS256 (útil para pruebas y para el upstream falso)."""
+    header = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    body = _b64url_encode(json.dumps(claims, separators=(",", ":")).encode())
+    signing_input = f"{header}.{body}".encode("ascii")
+    signature = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+    return f"{header}.{body}.{_b64url_encode(signature)}"
+
+
+def user_from_claims(claims: dict) -> Dict:
+    """Devuelve los campos de usuario con la misma forma que /auth/v1/user."""
+    return {
+        "id": claims["sub"],
+        "aud": claims.get("aud"),
+        "role": claims.get("role"),
+        "email": claims.get("email"),
+        "phone": claims.get("phone"),
+        "app_metadata": claims.get("app_metadata", {}),
+        "user_metadata": claims.get("user_metadata", {}),
+    }
+
+
+# ========= Verificador =========
+class JWTVerifier:
+    """
+    Verifica JWT de Supabase en local con el secreto del proyecto o con el
+    JWKS (cacheado y refrescado periódicamente). Los tokens ya validados se
+    guardan por hash durante TOKEN_CACHE_TTL, nunca más allá de su `exp`.
+    """
+
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        jwks_url: Optional[str] = None,
+        audience: Optional[str] = JWT_AUDIENCE,
+        cache_ttl: float = TOKEN_CACHE_TTL,
+        cache_size: int = TOKEN_CACHE_SIZE,
+        jwks_ttl: float = JWKS_TTL,
+    ):
+        self.secret = secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.jwks_ttl = jwks_ttl
+        self._cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._jwks: Dict[str, dict] = {}
+        self._jwks_fetched_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.secret or self.jwks_url)
+
+    async def verify(self, token: str) -> dict:
+        """Devuelve los claims del token o lanza InvalidToken/UnsupportedToken."""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires_at, claims = cached
+            if expires_at > now:
+                self._cache.move_to_end(key)
+                return claims
+            del self._cache[key]
+
+        try:
+            header_b64, body_b64, signature_b64 = token.split(".")
+            header = json.loads(_b64url_decode(header_b64))
+            claims = json.loads(_b64url_decode(body_b64))
+            signature = _b64url_decode(signature_b64)
+        except ValueError:
+            raise InvalidToken("Token mal formado")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidToken("Token mal formado")
+
+        alg = header.get("alg")
+        if alg == "HS256":
+            self._verify_hs256(f"{header_b64}.{body_b64}", signature)
+        elif alg in ("RS256", "ES256"):
+            await self._verify_jwks(token, header)
+        else:
+            raise InvalidToken(f"Algoritmo no permitido: {alg}")
+
+        self._check_claims(claims, now)
+
+        self._cache[key] = (min(now + self.cache_ttl, claims["exp"]), claims)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return claims
+
+    def _verify_hs256(self, signing_input: str, signature: bytes) -> None:
+        if not self.secret:
+            raise UnsupportedToken("SUPABASE_JWT_SECRET no configurado")
+        expected = hmac.new(self.secret.encode(), signing_input.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, signature):
+            raise InvalidToken("Firma inválida")
+
+    async def _verify_jwks(self, token: str, header: dict) -> None:
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise InvalidToken("kid inválido")
+        try:
+            import jwt
+        except ImportError:
+            raise UnsupportedToken("PyJWT no instalado")
+
+        jwk = await self._get_jwk(kid)
+        try:
+            # Solo la firma: exp/aud se comprueban igual que en HS256
+            jwt.decode(
+                token,
+                jwt.PyJWK(jwk).key,
+                algorithms=[header["alg"]],
+                options={"verify_exp": False, "verify_aud": False},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+
+    async def _get_jwk(self, kid: Optional[str]) -> dict:
+        if not self.jwks_url:
+            raise UnsupportedToken("JWKS no configurado")
+        stale = time.monotonic() - self._jwks_fetched_at > self.jwks_ttl
+        # Un kid desconocido puede ser una rotación de claves: refrescar (como mucho cada 30s)
+        unknown = kid not in self._jwks and time.monotonic() - self._jwks_fetched_at > 30
+        if stale or unknown:
+            await self._refresh_jwks()
+        jwk = self._jwks.get(kid)
+        if jwk is None:
+            raise InvalidToken("kid desconocido")
+        return jwk
+
+    async def _refresh_jwks(self) -> None:
+        self._jwks_fetched_at = time.monotonic()
+        try:
+            resp = await http_clients.request(
+                "supabase", "GET", self.jwks_url, headers={"apikey": SUPABASE_API_KEY or ""}
+            )
+            resp.raise_for_status()
+            self._jwks = {k.get("kid"): k for k in resp.json().get("keys", [])}
+        except Exception:
+            # Nos quedamos con las claves que ya teníamos
+            logger.exception("No se pudo refrescar el JWKS")
+
+    def _check_claims(self, claims: dict, now: float) -> None:
+        if "sub" not in claims or "exp" not in claims:
+            raise InvalidToken("Faltan claims obligatorios")
+        if not isinstance(claims["sub"], str):
+            raise InvalidToken("sub inválido")
+        if not _is_number(claims["exp"]) or not _is_number(claims.get("nbf", 0)):
+            raise InvalidToken("exp/nbf deben ser numéricos")
+        if claims["exp"] + JWT_LEEWAY < now:
+            raise InvalidToken("Token expirado")
+        if claims.get("nbf", 0) - JWT_LEEWAY > now:
+            raise InvalidToken("Token aún no válido")
+        if self.audience is not None:
+            aud = claims.get("aud")
+            auds = aud if isinstance(aud, list) else [aud]
+            if self.audience not in auds:
+                raise InvalidToken("Audiencia inválida")
+
+
+verifier = JWTVerifier(secret=SUPABASE_JWT_SECRET, jwks_url=SUPABASE_JWKS_URL)
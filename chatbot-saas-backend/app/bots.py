@@ -0,0 +1,128 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.models import ChatbotConfig
+from app.singleflight import SingleFlight
+
+logger = logging.getLogger("tubot.bots")
+
+DEFAULT_MODEL = "mistralai/mistral-7b-instruct"
+
+
+class CompiledBot:
+    """Configuración de un bot ya validada, con el prompt de sistema construido."""
+
+    __slots__ = ("id", "user_id", "model", "temperature", "cache", "system_prompt")
+
+    def __init__(self, row: dict):
+        config = ChatbotConfig(**{
+            **(row.get("config") or {}),
+            "name": row["name"],
+            "description": row.get("description") or "",
+        })
+        self.id = row["id"]
+        self.user_id = row.get("user_id")
+        self.model = config.model or DEFAULT_MODEL
+        self.temperature = config.temperature if config.temperature is not None else 0.7
+        self.cache = config.cache
+        self.system_prompt = build_system_prompt(config)
+
+
+def build_system_prompt(config: ChatbotConfig) -> str:
+    parts = [f"Eres {config.name}."]
+    if config.description:
+        parts.append(config.description.strip())
+    if config.instructions:
+        parts.append(config.instructions.strip())
+    return "\n\n".join(parts)
+
+
+class BotConfigCache:
+    """
+    Caché read-through de configuraciones de bot con TTL. Los bots que no
+    existen también se cachean (con `negative_ttl`), igual que los errores al
+    cargarlos (con `error_ttl`, y se vuelven a lanzar), en una LRU aparte para
+    que los ids inventados no echen a los bots reales. Las cargas concurrentes
+    del mismo bot comparten una sola consulta a Supabase.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[Optional[dict]]],
+        ttl: float = 300,
+        negative_ttl: float = 30,
+        error_ttl: float = 5,
+        max_entries: int = 10000,
+        max_negative_entries: int = 10000,
+    ):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.max_negative_entries = max_negative_entries
+        self._entries: "OrderedDict[str, Tuple[float, CompiledBot]]" = OrderedDict()
+        # bot_id -> (caduca, error o None si el bot no existe)
+        self._negative: "OrderedDict[str, Tuple[float, Optional[Exception]]]" = OrderedDict()
+        self._inflight = SingleFlight()
+        # Se incrementa al invalidar, para descartar cargas que empezaron antes
+        self._versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, bot_id: str) -> Optional[CompiledBot]:
+        now = time.monotonic()
+        entry = self._entries.get(bot_id)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(bot_id)
+            self.hits += 1
+            return entry[1]
+        negative = self._negative.get(bot_id)
+        if negative is not None and negative[0] > now:
+            self.hits += 1
+            if negative[1] is not None:
+                raise negative[1]
+            return None
+
+        self.misses += 1
+        version = self._versions.get(bot_id, 0)
+        return await self._inflight.do(f"{bot_id}:{version}", lambda: self._load(bot_id, version))
+
+    async def _load(self, bot_id: str, version: int) -> Optional[CompiledBot]:
+        try:
+            row = await self.loader(bot_id)
+        except Exception as e:
+            if self._versions.get(bot_id, 0) == version:
+                self._remember(self._negative, bot_id, (time.monotonic() + self.error_ttl, e))
+            raise
+        bot = CompiledBot(row) if row is not None else None
+        if self._versions.get(bot_id, 0) != version:
+            return bot
+        if bot is None:
+            self._remember(self._negative, bot_id, (time.monotonic() + self.negative_ttl, None))
+        else:
+            self._negative.pop(bot_id, None)
+            self._remember(self._entries, bot_id, (time.monotonic() + self.ttl, bot))
+        return bot
+
+    def _remember(self, entries: OrderedDict, bot_id: str, entry: tuple) -> None:
+        entries[bot_id] = entry
+        entries.move_to_end(bot_id)
+        limit = self.max_entries if entries is self._entries else self.max_negative_entries
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def invalidate(self, bot_id: str) -> None:
+        self._entries.pop(bot_id, None)
+        self._negative.pop(bot_id, None)
+        self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "negative_entries": len(self._negative),
+        }
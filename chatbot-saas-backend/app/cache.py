@@ -0,0 +1,119 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def make_key(payload: dict) -> str:
+    """Hash canónico del payload (mismo contenido => misma clave)."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ========= Backends compartidos =========
+class CacheBackend:
+    """
+    Interfaz para un backend compartido entre workers (Redis, Memcached...).
+    Los valores son bytes y el backend es responsable de respetar el TTL.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+
+class LocalSharedBackend(CacheBackend):
+    """Sustituto en memoria del backend compartido, para desarrollo y pruebas."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+
+
+# ========= Caché de respuestas =========
+class ResponseCache:
+    """
+    LRU en proceso limitada por bytes y con TTL, opcionalmente respaldada
+    por un backend compartido. Los valores son dicts serializables a JSON.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, shared: Optional[CacheBackend] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = self._get_local(key)
+        if raw is None and self.shared is not None:
+            raw = await self.shared.get(key)
+            if raw is not None:
+                self._set_local(key, raw)
+
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: dict) -> None:
+        raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._set_local(key, raw)
+        if self.shared is not None:
+            await self.shared.set(key, raw, self.ttl)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _get_local(self, key: str) -> Optional[bytes]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, raw = item
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return raw
+
+    def _set_local(self, key: str, raw: bytes) -> None:
+        if len(raw) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, raw)
+        self._bytes += len(raw)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, raw = self._entries.pop(key)
+        self._bytes -= len(raw)
@@ -0,0 +1,230 @@
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("tubot.context")
+
+# Tokens extra por mensaje (rol, separadores) en el formato de chat
+MESSAGE_OVERHEAD = 4
+
+# Caracteres por token aproximados cuando no hay tokenizador exacto
+_CHARS_PER_TOKEN = {
+    "openai/": 4.0,
+    "anthropic/": 3.5,
+    "mistralai/": 3.5,
+    "meta-llama/": 3.7,
+    "google/": 4.0,
+}
+_DEFAULT_CHARS_PER_TOKEN = 3.5
+
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+
+# (resumen_anterior, mensajes_nuevos, modelo) -> (resumen_nuevo, tokens_usados)
+Summarizer = Callable[[str, List[dict], str], Awaitable[Tuple[str, Optional[int]]]]
+# Recibe los tokens gastados en resúmenes para cobrárselos al tenant
+UsageCallback = Callable[[Optional[int]], Awaitable[None]]
+
+
+class SummaryStore:
+    """Dónde se guarda el resumen de cada conversación: (mensajes resumidos, resumen)."""
+
+    async def get_summary(self, conversation_id: str) -> Tuple[int, str]:
+        raise NotImplementedError
+
+    async def set_summary(self, conversation_id: str, upto: int, summary: str) -> None:
+        raise NotImplementedError
+
+
+class InMemorySummaries(SummaryStore):
+    """LRU en proceso; el store de conversaciones guarda el resumen de forma persistente."""
+
+    def __init__(self, max_conversations: int = 1000):
+        self.max_conversations = max_conversations
+        self._summaries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+
+    async def get_summary(self, conversation_id: str) -> Tuple[int, str]:
+        if conversation_id in self._summaries:
+            self._summaries.move_to_end(conversation_id)
+        return self._summaries.get(conversation_id, (0, ""))
+
+    async def set_summary(self, conversation_id: str, upto: int, summary: str) -> None:
+        self._summaries[conversation_id] = (upto, summary)
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > self.max_conversations:
+            self._summaries.popitem(last=False)
+
+
+def _tiktoken_encoding(model: str):
+    """Tokenizador exacto para modelos de OpenAI si `tiktoken` está instalado."""
+    # El modelo lo puede elegir el cliente: solo los de OpenAI llegan a la caché
+    if not model.startswith("openai/"):
+        return None
+    return _openai_encoding(model.split("/", 1)[1])
+
+
+@lru_cache(maxsize=32)
+def _openai_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _tiktoken_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ratio = next(
+        (r for prefix, r in _CHARS_PER_TOKEN.items() if model.startswith(prefix)),
+        _DEFAULT_CHARS_PER_TOKEN,
+    )
+    return int(len(text) / ratio) + 1
+
+
+def count_message_tokens(message: dict, model: str) -> int:
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD
+
+
+class ContextBuilder:
+    """
+    Recorta el historial a un presupuesto de tokens: conserva el prompt de
+    sistema y los turnos más recientes, y los turnos antiguos de una
+    conversación se condensan en un resumen incremental guardado en `store`
+    (solo se resumen los mensajes que no estaban ya resumidos, en trozos que
+    caben en el presupuesto). Al resumir se pliega hasta `fold_ratio` del
+    presupuesto para que los siguientes turnos quepan sin volver a llamar al
+    resumidor. Sin conversation_id, los turnos antiguos simplemente se descartan.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        summarizer: Optional[Summarizer] = None,
+        summary_budget: int = 300,
+        fold_ratio: float = 0.6,
+        store: Optional[SummaryStore] = None,
+        max_fold_chunks: int = 4,
+    ):
+        self.budget = budget
+        self.summarizer = summarizer
+        self.summary_budget = summary_budget
+        self.fold_ratio = fold_ratio
+        self.store = store or InMemorySummaries()
+        # Llamadas al resumidor por turno; si hay más atraso, sigue en los siguientes
+        self.max_fold_chunks = max_fold_chunks
+
+    async def build(
+        self,
+        system: str,
+        messages: List[dict],
+        model: str,
+        conversation_id: Optional[str] = None,
+        on_usage: Optional[UsageCallback] = None,
+        offset: int = 0,
+        max_messages: Optional[int] = None,
+    ) -> Tuple[str, List[dict]]:
+        """
+        Devuelve (prompt de sistema, mensajes) dentro del presupuesto.
+
+        En conversaciones, `messages` puede ser solo la ventana final del
+        historial: `offset` es la posición del primero en la conversación y
+        `max_messages` cuántos pueden quedar sin resumir para que la ventana
+        del turno siguiente siga empezando antes de lo no resumido.
+        """
+        if self.budget <= 0:
+            return system, messages
+
+        used = count_tokens(system, model) + MESSAGE_OVERHEAD
+        summarize = conversation_id is not None and self.summarizer is not None
+        if summarize:
+            used += self.summary_budget
+
+        cut = self._cut(messages, model, used, self.budget)
+        if summarize and max_messages is not None:
+            cut = max(cut, len(messages) - max_messages)
+        if cut == 0:
+            return system, messages
+        if conversation_id is None or self.summarizer is None:
+            logger.info(f"Contexto recortado: {cut} mensajes antiguos descartados")
+            return system, messages[cut:]
+
+        upto, summary = await self.store.get_summary(conversation_id)
+        if upto < offset:
+            logger.warning(
+                f"{offset - upto} mensajes de {conversation_id} quedan fuera de la ventana sin resumir"
+            )
+            upto = offset
+        done = upto - offset
+        if cut > done:
+            fold = max(cut, self._cut(messages, model, used, int(self.budget * self.fold_ratio)))
+            if max_messages is not None:
+                fold = max(fold, len(messages) - int(max_messages * self.fold_ratio))
+            fold = min(fold, len(messages) - 1)
+            upto, summary = await self._fold(conversation_id, upto, summary, messages[done:fold], model, on_usage)
+            done = upto - offset
+
+        # Lo que ya está en el resumen no se repite
+        recent = messages[max(cut, done):]
+        if summary:
+            system = f"{system}\n\n{SUMMARY_HEADER}\n{summary}" if system else f"{SUMMARY_HEADER}\n{summary}"
+        return system, recent
+
+    async def _fold(
+        self,
+        conversation_id: str,
+        upto: int,
+        summary: str,
+        messages: List[dict],
+        model: str,
+        on_usage: Optional[UsageCallback],
+    ) -> Tuple[int, str]:
+        """
+        Añade `messages` al resumen en trozos que caben en el presupuesto
+        (junto al resumen anterior y la respuesta). Cada trozo se guarda al
+        terminar, así un fallo no obliga a repetir los anteriores.
+        """
+        chunks = self._chunks(messages, model, max(self.budget - 2 * self.summary_budget, self.summary_budget))
+        for chunk in chunks[:self.max_fold_chunks]:
+            try:
+                summary, tokens_used = await self.summarizer(summary, chunk, model)
+            except Exception:
+                logger.exception("No se pudo actualizar el resumen; se descartan los turnos antiguos")
+                break
+            if on_usage is not None:
+                await on_usage(tokens_used)
+            upto += len(chunk)
+            await self.store.set_summary(conversation_id, upto, summary)
+        return upto, summary
+
+    @staticmethod
+    def _chunks(messages: List[dict], model: str, budget: int) -> List[List[dict]]:
+        chunks: List[List[dict]] = []
+        used = budget
+        for message in messages:
+            cost = count_message_tokens(message, model)
+            if used + cost > budget:
+                chunks.append([])
+                used = 0
+            chunks[-1].append(message)
+            used += cost
+        return chunks
+
+    @staticmethod
+    def _cut(messages: List[dict], model: str, used: int, budget: int) -> int:
+        """
+        Índice del primer mensaje que entra en `budget`, recorriendo desde el
+        final (el último mensaje siempre entra).
+        """
+        cut = len(messages)
+        while cut > 0:
+            cost = count_message_tokens(messages[cut - 1], model)
+            if used + cost > budget and cut < len(messages):
+                break
+            used += cost
+            cut -= 1
+        return cut
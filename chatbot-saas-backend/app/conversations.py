@@ -0,0 +1,282 @@
+import asyncio
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.models import ConversationDB, MessageCreate, MessageDB
+
+
+# ========= Interfaz =========
+class ConversationStore:
+    """Almacén de conversaciones. Las implementaciones son intercambiables."""
+
+    async def create_conversation(self, user_id: str, bot_id: str) -> ConversationDB:
+        raise NotImplementedError
+
+    async def get_conversation(self, conversation_id: str) -> Optional[ConversationDB]:
+        raise NotImplementedError
+
+    async def append(self, conversation_id: str, user_id: str, message: MessageCreate) -> MessageDB:
+        raise NotImplementedError
+
+    async def history(self, conversation_id: str, limit: Optional[int] = None) -> List[MessageDB]:
+        """Mensajes en orden cronológico; con `limit`, solo los últimos."""
+        raise NotImplementedError
+
+    async def count(self, conversation_id: str) -> int:
+        """Número de mensajes de la conversación."""
+        raise NotImplementedError
+
+    async def get_summary(self, conversation_id: str) -> Tuple[int, str]:
+        """Resumen de los turnos antiguos: (mensajes ya resumidos, resumen)."""
+        raise NotImplementedError
+
+    async def set_summary(self, conversation_id: str, upto: int, summary: str) -> None:
+        raise NotImplementedError
+
+
+# ========= SQLite =========
+class SQLiteConversationStore(ConversationStore):
+    """
+    Backend SQLite para uso local y pruebas (`:memory:` vale). Las consultas
+    se ejecutan en un hilo para no bloquear el event loop.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    bot_id TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    conversation_id TEXT NOT NULL REFERENCES conversations(id),
+                    bot_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_conversation
+                    ON messages (conversation_id, seq);
+                CREATE TABLE IF NOT EXISTS conversation_summaries (
+                    conversation_id TEXT PRIMARY KEY REFERENCES conversations(id),
+                    upto INTEGER NOT NULL,
+                    summary TEXT NOT NULL
+                );
+                """
+            )
+
+    def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return asyncio.to_thread(locked)
+
+    async def create_conversation(self, user_id: str, bot_id: str) -> ConversationDB:
+        conversation = ConversationDB(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            bot_id=bot_id,
+            created_at=datetime.now(timezone.utc),
+        )
+
+        def insert():
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO conversations (id, user_id, bot_id, created_at) VALUES (?, ?, ?, ?)",
+                    (conversation.id, user_id, bot_id, conversation.created_at.isoformat()),
+                )
+
+        await self._run(insert)
+        return conversation
+
+    async def get_conversation(self, conversation_id: str) -> Optional[ConversationDB]:
+        def select():
+            return self._conn.execute(
+                "SELECT * FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+
+        row = await self._run(select)
+        return ConversationDB(**dict(row)) if row is not None else None
+
+    async def append(self, conversation_id: str, user_id: str, message: MessageCreate) -> MessageDB:
+        stored = MessageDB(
+            id=uuid.uuid4().hex,
+            conversation_id=conversation_id,
+            user_id=user_id,
+            created_at=datetime.now(timezone.utc),
+            **message.dict(),
+        )
+
+        def insert():
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO messages (id, conversation_id, bot_id, user_id, role, content, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        stored.id, conversation_id, stored.bot_id, user_id,
+                        stored.role, stored.content, stored.created_at.isoformat(),
+                    ),
+                )
+
+        await self._run(insert)
+        return stored
+
+    async def history(self, conversation_id: str, limit: Optional[int] = None) -> List[MessageDB]:
+        def select():
+            if limit is None:
+                return self._conn.execute(
+                    "SELECT * FROM messages WHERE conversation_id = ? ORDER BY seq",
+                    (conversation_id,),
+                ).fetchall()
+            rows = self._conn.execute(
+                "SELECT * FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+                (conversation_id, limit),
+            ).fetchall()
+            return rows[::-1]
+
+        rows = await self._run(select)
+        return [MessageDB(**{k: row[k] for k in row.keys() if k != "seq"}) for row in rows]
+
+    async def count(self, conversation_id: str) -> int:
+        def select():
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()[0]
+
+        return await self._run(select)
+
+    async def get_summary(self, conversation_id: str) -> Tuple[int, str]:
+        def select():
+            return self._conn.execute(
+                "SELECT upto, summary FROM conversation_summaries WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+
+        row = await self._run(select)
+        return (row["upto"], row["summary"]) if row is not None else (0, "")
+
+    async def set_summary(self, conversation_id: str, upto: int, summary: str) -> None:
+        def upsert():
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO conversation_summaries (conversation_id, upto, summary) VALUES (?, ?, ?)"
+                    " ON CONFLICT (conversation_id) DO UPDATE SET upto = excluded.upto, summary = excluded.summary",
+                    (conversation_id, upto, summary),
+                )
+
+        await self._run(upsert)
+
+
+# ========= Caché de la cola caliente =========
+class _Tail:
+    def __init__(self, messages: List[MessageDB], size: int, total: int):
+        self.messages: Deque[MessageDB] = deque(messages, maxlen=size)
+        # Mensajes de la conversación entera (la cola guarda solo los últimos)
+        self.total = total
+        # (mensajes resumidos, resumen); None hasta que se lee del store
+        self.summary: Optional[Tuple[int, str]] = None
+
+
+class CachedConversationStore(ConversationStore):
+    """
+    Mantiene en memoria los últimos `tail_size` mensajes de las conversaciones
+    activas (LRU de `max_conversations`) y delega el resto en otro store.
+    """
+
+    def __init__(self, store: ConversationStore, tail_size: int = 50, max_conversations: int = 1000):
+        self.store = store
+        self.tail_size = tail_size
+        self.max_conversations = max_conversations
+        self._tails: "OrderedDict[str, _Tail]" = OrderedDict()
+        self._conversations: Dict[str, ConversationDB] = {}
+
+    async def create_conversation(self, user_id: str, bot_id: str) -> ConversationDB:
+        conversation = await self.store.create_conversation(user_id, bot_id)
+        self._remember(conversation, _Tail([], self.tail_size, total=0))
+        return conversation
+
+    async def get_conversation(self, conversation_id: str) -> Optional[ConversationDB]:
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            self._tails.move_to_end(conversation_id)
+            return conversation
+        return await self.store.get_conversation(conversation_id)
+
+    async def append(self, conversation_id: str, user_id: str, message: MessageCreate) -> MessageDB:
+        stored = await self.store.append(conversation_id, user_id, message)
+        tail = self._tails.get(conversation_id)
+        if tail is not None:
+            tail.messages.append(stored)
+            tail.total += 1
+        return stored
+
+    async def history(self, conversation_id: str, limit: Optional[int] = None) -> List[MessageDB]:
+        tail = await self._load_tail(conversation_id)
+        complete = tail is not None and tail.total == len(tail.messages)
+        if tail is not None and (complete or (limit is not None and limit <= self.tail_size)):
+            messages = list(tail.messages)
+            return messages[-limit:] if limit else messages
+        return await self.store.history(conversation_id, limit)
+
+    async def count(self, conversation_id: str) -> int:
+        tail = await self._load_tail(conversation_id)
+        return tail.total if tail is not None else 0
+
+    async def get_summary(self, conversation_id: str) -> Tuple[int, str]:
+        tail = await self._load_tail(conversation_id)
+        if tail is None:
+            return await self.store.get_summary(conversation_id)
+        if tail.summary is None:
+            tail.summary = await self.store.get_summary(conversation_id)
+        return tail.summary
+
+    async def set_summary(self, conversation_id: str, upto: int, summary: str) -> None:
+        await self.store.set_summary(conversation_id, upto, summary)
+        tail = self._tails.get(conversation_id)
+        if tail is not None:
+            tail.summary = (upto, summary)
+
+    async def _load_tail(self, conversation_id: str) -> Optional[_Tail]:
+        tail = self._tails.get(conversation_id)
+        if tail is not None:
+            self._tails.move_to_end(conversation_id)
+            return tail
+        conversation = await self.store.get_conversation(conversation_id)
+        if conversation is None:
+            return None
+        messages = await self.store.history(conversation_id, self.tail_size)
+        total = len(messages)
+        if total == self.tail_size:
+            total = await self.store.count(conversation_id)
+        tail = _Tail(messages, self.tail_size, total)
+        self._remember(conversation, tail)
+        return tail
+
+    def _remember(self, conversation: ConversationDB, tail: _Tail) -> None:
+        self._tails[conversation.id] = tail
+        self._conversations[conversation.id] = conversation
+        while len(self._tails) > self.max_conversations:
+            evicted, _ = self._tails.popitem(last=False)
+            self._conversations.pop(evicted, None)
+
+
+def make_store(url: str, tail_size: int = 50) -> ConversationStore:
+    """Crea el store a partir de una URL: `sqlite:///ruta.db` o `sqlite:///:memory:`."""
+    if url.startswith("sqlite:///"):
+        store = SQLiteConversationStore(url[len("sqlite:///"):])
+    else:
+        raise ValueError(f"Backend de conversaciones no soportado: {url}")
+    return CachedConversationStore(store, tail_size=tail_size)
@@ -0,0 +1,202 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import random
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger("tubot.http")
+
+# ========= Config =========
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 necesita el paquete `h2` (pip install httpx[http2])
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+# Timeouts y reintentos por upstream
+UPSTREAMS = {
+    "openrouter": {
+        "timeout": httpx.Timeout(float(os.getenv("OPENROUTER_TIMEOUT", "30")), connect=5.0),
+        "retries": int(os.getenv("OPENROUTER_RETRIES", "0")),
+    },
+    "openai": {
+        "timeout": httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "30")), connect=5.0),
+        "retries": 0,
+    },
+    "groq": {
+        "timeout": httpx.Timeout(float(os.getenv("GROQ_TIMEOUT", "30")), connect=5.0),
+        "retries": 0,
+    },
+    "supabase": {
+        "timeout": httpx.Timeout(float(os.getenv("SUPABASE_TIMEOUT", "10")), connect=3.0),
+        "retries": int(os.getenv("SUPABASE_RETRIES", "2")),
+    },
+}
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+# ========= Métricas del pool =========
+class PoolMeter:
+    """
+    Peticiones en vuelo y conexiones del pool. Con HTTP/2 muchas peticiones
+    comparten una conexión, así que la ocupación y la saturación se miden en
+    conexiones del pool de transporte, no en peticiones.
+    """
+
+    def __init__(self, max_connections: int, pool=None):
+        self.max_connections = max_connections
+        # httpcore.AsyncConnectionPool del transporte
+        self.pool = pool
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        # Peticiones que empezaron con el pool lleno (tuvieron que esperar conexión)
+        self.saturated = 0
+
+    def _connections(self) -> list:
+        return list(getattr(self.pool, "connections", None) or [])
+
+    def _full(self) -> bool:
+        if self.pool is None:
+            return self.in_flight >= self.max_connections
+        connections = self._connections()
+        return len(connections) >= self.max_connections and not any(c.is_available() for c in connections)
+
+    def acquire(self) -> None:
+        if self._full():
+            self.saturated += 1
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        connections = self._connections()
+        in_use = sum(1 for c in connections if not c.is_idle()) if self.pool is not None else self.in_flight
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "connections": len(connections),
+            "connections_in_use": in_use,
+            "max_connections": self.max_connections,
+            "utilisation": in_use / self.max_connections,
+            "requests": self.requests,
+            "saturated": self.saturated,
+        }
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    def __init__(self, inner: httpx.AsyncByteStream, meter: PoolMeter):
+        self._inner = inner
+        self._meter = meter
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._meter.release()
+        await self._inner.aclose()
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """Transporte que mide la ocupación hasta que se cierra la respuesta."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, meter: PoolMeter):
+        self._inner = inner
+        self._meter = meter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._meter.acquire()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException:
+            self._meter.release()
+            raise
+        response.stream = _MeteredStream(response.stream, self._meter)
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+# ========= Registro de clientes =========
+_clients: Dict[str, httpx.AsyncClient] = {}
+_meters: Dict[str, PoolMeter] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2_ENABLED=1 pero el paquete `h2` no está instalado; se usa HTTP/1.1")
+        return False
+    return True
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Devuelve el cliente compartido de un upstream, creándolo la primera vez."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=_http2_available())
+        meter = PoolMeter(HTTP_MAX_CONNECTIONS, getattr(transport, "_pool", None))
+        client = httpx.AsyncClient(
+            transport=_MeteredTransport(transport, meter),
+            timeout=UPSTREAMS[name]["timeout"],
+        )
+        _clients[name] = client
+        _meters[name] = meter
+    return client
+
+
+async def close_all() -> None:
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def pool_stats() -> dict:
+    return {name: meter.stats() for name, meter in _meters.items()}
+
+
+async def request(
+    name: str, method: str, url: str, *, retry: Optional[bool] = None, **kwargs
+) -> httpx.Response:
+    """
+    Petición con el cliente compartido. Los métodos idempotentes se reintentan
+    con backoff exponencial (con jitter) ante errores de red y 429/502/503/504.
+    """
+    client = get_client(name)
+    if retry is None:
+        retry = method.upper() in IDEMPOTENT_METHODS
+    attempts = 1 + (UPSTREAMS[name]["retries"] if retry else 0)
+
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            resp = await client.request(method, url, **kwargs)
+            if last or resp.status_code not in RETRY_STATUS_CODES:
+                return resp
+            await resp.aclose()
+            logger.warning(f"{name} respondió {resp.status_code}, reintentando")
+        except httpx.TransportError as e:
+            if last:
+                raise
+            logger.warning(f"Error de red con {name} ({e!r}), reintentando")
+        await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
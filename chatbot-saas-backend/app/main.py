@@ -1,20 +1,115 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import math
 import os
+import time
+import json
 import httpx
 import logging
 
+from app import http_clients, metrics
+from app.bots import BotConfigCache, CompiledBot
+from app.cache import LocalSharedBackend, ResponseCache, make_key
+from app.context import SUMMARY_HEADER, ContextBuilder, UsageCallback
+from app.conversations import make_store
+from app.metrics import MetricsMiddleware, TimedRoute, registry
+from app.models import (
+    ChatbotConfig, ConversationCreate, ConversationDB, ConversationReply, ConversationTurn,
+    MessageCreate, MessageDB,
+)
+from app.providers import NoProviderAvailable, llm_router
+from app.ratelimit import (
+    AdmissionController, AdmissionMiddleware, FairLimiter, InMemoryBackend, QueueTimeout, RateLimited, bot_for,
+    tenant_for,
+)
+from app.singleflight import SingleFlight
+from app.supabase_client import current_user, current_user_strict, get_chatbot, update_chatbot
+
 # ========= Config =========
 # Pon aquí tu dominio real de Vercel (¡sin slash final!)
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://tu-bot.vercel.app")
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Los proveedores de IA (OpenRouter, OpenAI, Groq) se configuran en app.providers
+
+# Caché de respuestas (opt-in)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+# "local" = sustituto en memoria del backend compartido
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "")
+
+# Agrupar peticiones idénticas concurrentes en una sola llamada upstream
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Historial de conversaciones en el servidor. La cola (TAIL_SIZE) es también la
+# ventana que se lee en cada turno: lo anterior se condensa en el resumen
+CONVERSATION_STORE_URL = os.getenv("CONVERSATION_STORE_URL", "sqlite:///conversations.db")
+CONVERSATION_TAIL_SIZE = int(os.getenv("CONVERSATION_TAIL_SIZE", "50"))
+
+# Configuración de bots (leída de Supabase y cacheada)
+BOT_CONFIG_TTL = float(os.getenv("BOT_CONFIG_TTL", "300"))
+
+# Presupuesto de tokens del prompt (0 = sin recorte) y del resumen de turnos antiguos
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+SUMMARY_PROMPT = (
+    "Resume de forma concisa la conversación, conservando nombres, datos y "
+    "decisiones importantes. Responde solo con el resumen."
+)
+
+# Control de admisión por tenant (usuario / bot / IP)
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "2"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+# Límite por bot (X-Bot-Id) entre todas las IPs, además del de cada tenant (0 = sin límite)
+BOT_RATE_LIMIT_RPS = float(os.getenv("BOT_RATE_LIMIT_RPS", "20"))
+BOT_RATE_LIMIT_BURST = int(os.getenv("BOT_RATE_LIMIT_BURST", "100"))
+# Tokens de IA por tenant y ventana (0 = sin límite)
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_WINDOW = float(os.getenv("TOKEN_BUDGET_WINDOW", "3600"))
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "64"))
+MAX_CONCURRENCY_PER_TENANT = int(os.getenv("MAX_CONCURRENCY_PER_TENANT", "4"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "256"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "30"))
+
+# Lotes (/chatbot/batch)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+# Espera máxima de admisión (rate limit + cola) por elemento del lote
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", "120"))
+
+# Métricas Prometheus en /metrics y cabeceras Server-Timing
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Si se define, /metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 # ========= App =========
 app = FastAPI(title="TuBot API")
 
+admission = AdmissionController(
+    backend=InMemoryBackend(),
+    rate=RATE_LIMIT_RPS,
+    burst=RATE_LIMIT_BURST,
+    token_budget=TOKEN_BUDGET,
+    budget_window=TOKEN_BUDGET_WINDOW,
+    limiter=FairLimiter(MAX_CONCURRENCY, MAX_CONCURRENCY_PER_TENANT, MAX_QUEUE),
+    queue_timeout=QUEUE_TIMEOUT,
+    bot_rate=BOT_RATE_LIMIT_RPS,
+    bot_burst=BOT_RATE_LIMIT_BURST,
+    # _bot_exists (con la caché de bots) se define más abajo
+    bot_exists=lambda bot_id: _bot_exists(bot_id),
+)
+# Se registra antes que CORS (queda por dentro) para que los 429 lleven cabeceras CORS
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    paths=("/chatbot/message", "/chatbot/conversations/message"),
+)
+
 # CORS:
 # - allow_origins: dominios exactos (prod + dev local)
 # - allow_origin_regex: previews de Vercel (*.vercel.app)
@@ -25,9 +120,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-router = APIRouter(prefix="/chatbot", tags=["chatbot"])
+# La última en registrarse queda por fuera: mide también CORS y los 429
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+router = APIRouter(prefix="/chatbot", tags=["chatbot"], route_class=TimedRoute)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tubot")
@@ -39,75 +139,166 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
+    # Con bot_id, instrucciones/modelo/temperatura salen de la config del bot
     instructions: str = Field(default="", max_length=1000)
     model: str = Field(default="mistralai/mistral-7b-instruct")
+    temperature: float = Field(default=0.7, ge=0, le=1)
+    bot_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     reply: str
     model_used: str
     tokens_used: Optional[int] = None
 
-# ========= HTTP client (ciclo de vida) =========
-client: httpx.AsyncClient | None = None
-
-@app.on_event("startup")
-async def _startup():
-    global client
-    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+class BatchRequest(BaseModel):
+    requests: List[ChatRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    # El límite por tenant (MAX_CONCURRENCY_PER_TENANT) también se aplica
+    concurrency: int = Field(default=BATCH_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY)
 
+# ========= HTTP client (ciclo de vida) =========
+# Los clientes viven en app.http_clients (pool compartido entre upstreams)
 @app.on_event("shutdown")
 async def _shutdown():
-    global client
-    if client is not None:
-        await client.aclose()
-        client = None
+    await http_clients.close_all()
 
-# ========= Rutas =========
-@router.post("/message", response_model=ChatResponse)
-async def chatbot_message(data: ChatRequest):
+# ========= Caché de respuestas =========
+response_cache: ResponseCache | None = None
+if RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(
+        max_bytes=RESPONSE_CACHE_MAX_BYTES,
+        ttl=RESPONSE_CACHE_TTL,
+        shared=LocalSharedBackend() if RESPONSE_CACHE_SHARED == "local" else None,
+    )
+
+def _cache_key(payload: dict, cache: Optional[bool]) -> Optional[str]:
     """
-    Envía mensajes a OpenRouter y devuelve la respuesta.
+    Devuelve la clave de caché o None si esta petición no se debe cachear.
+    `cache` es la política del bot (nunca del cliente): None = solo si es
+    determinista (temperature 0), True = siempre, False = nunca.
     """
-    if not OPENROUTER_API_KEY:
+    if response_cache is None or cache is False:
+        return None
+    if payload["temperature"] != 0 and cache is not True:
+        return None
+    return make_key(payload)
+
+# ========= Single-flight =========
+inflight: SingleFlight | None = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+
+# ========= Conversaciones =========
+conversations = make_store(CONVERSATION_STORE_URL, tail_size=CONVERSATION_TAIL_SIZE)
+
+# ========= Configuración de bots =========
+bot_configs = BotConfigCache(get_chatbot, ttl=BOT_CONFIG_TTL)
+
+async def _get_bot(bot_id: str) -> CompiledBot:
+    bot = await bot_configs.get(bot_id)
+    if bot is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot no encontrado")
+    return bot
+
+async def _bot_exists(bot_id: str) -> bool:
+    return await bot_configs.get(bot_id) is not None
+
+async def _with_bot_config(data: ChatRequest, bot_id: str):
+    """Sustituye los ajustes que manda el cliente por los del bot."""
+    with metrics.stage("bot_config"):
+        bot = await _get_bot(bot_id)
+    update = {
+        "model": bot.model,
+        "instructions": bot.system_prompt,
+        "temperature": bot.temperature,
+    }
+    return data.model_copy(update=update), bot
+
+async def _resolve_chat(data: ChatRequest) -> Tuple[ChatRequest, Optional[bool]]:
+    """Aplica la config del bot (si hay bot_id) y devuelve su política de caché."""
+    if data.bot_id is None:
+        return data, None
+    data, bot = await _with_bot_config(data, data.bot_id)
+    return data, bot.cache
+
+# ========= Ventana de contexto =========
+async def _summarize(previous: str, messages: List[dict], model: str) -> Tuple[str, Optional[int]]:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous:
+        transcript = f"{SUMMARY_HEADER}\n{previous}\n\nMensajes nuevos:\n{transcript}"
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        "temperature": 0,
+        "max_tokens": CONTEXT_SUMMARY_TOKENS,
+    }
+    result = await _complete(payload)
+    return result["reply"].strip(), result["tokens_used"]
+
+context_builder = ContextBuilder(
+    budget=CONTEXT_TOKEN_BUDGET,
+    summarizer=_summarize,
+    summary_budget=CONTEXT_SUMMARY_TOKENS,
+    # El resumen y hasta dónde llega se guardan junto a la conversación
+    store=conversations,
+)
+
+# ========= Helpers IA =========
+def _ensure_configured():
+    if not llm_router.providers:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="OPENROUTER_API_KEY no está configurada en el servidor."
+            detail="No hay ningún proveedor de IA configurado en el servidor."
         )
 
-    assert client is not None, "HTTP client no inicializado"
+async def _build_payload(
+    data: ChatRequest,
+    messages: Optional[List[dict]] = None,
+    conversation_id: Optional[str] = None,
+    on_usage: Optional[UsageCallback] = None,
+    offset: int = 0,
+) -> dict:
+    metrics.annotate(model=data.model)
+    with metrics.stage("payload"):
+        if messages is None:
+            messages = [m.dict() for m in data.messages]
+        system, messages = await context_builder.build(
+            data.instructions, messages, data.model, conversation_id, on_usage,
+            offset=offset,
+            # El mensaje nuevo y la respuesta entran en la ventana del turno siguiente
+            max_messages=max(CONVERSATION_TAIL_SIZE - 1, 1) if conversation_id is not None else None,
+        )
+    return {
+        "model": data.model,
+        "messages": [{"role": "system", "content": system}] + messages,
+        "temperature": data.temperature,
+        "max_tokens": 1000,
+    }
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
+async def _fetch_completion(payload: dict, cache_key: Optional[str]) -> dict:
+    result = await llm_router.complete(payload)
+    if cache_key is not None:
+        await response_cache.set(cache_key, result)
+    return result
+
+async def _complete(payload: dict, cache: Optional[bool] = None) -> dict:
+    """Caché -> single-flight -> router de proveedores. Devuelve {reply, tokens_used}."""
     try:
-        logger.info(f"Petición para modelo: {data.model}")
-
-        payload = {
-            "model": data.model,
-            "messages": (
-                [{"role": "system", "content": data.instructions}]
-                + [m.dict() for m in data.messages]
-            ),
-            "temperature": 0.7,
-            "max_tokens": 1000,
-        }
-
-        resp = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                # OpenRouter recomienda referer + title para métricas/permit-list
-                "HTTP-Referer": FRONTEND_URL,
-                "X-Title": "TuBot",
-            },
-            json=payload,
-        )
-        resp.raise_for_status()
-        j = resp.json()
+        key = _cache_key(payload, cache)
+        if key is not None:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return cached
 
-        return ChatResponse(
-            reply=j["choices"][0]["message"]["content"],
-            model_used=data.model,
-            tokens_used=j.get("usage", {}).get("total_tokens"),
-        )
+        if inflight is not None:
+            return await inflight.do(
+                key or make_key(payload), lambda: _fetch_completion(payload, key)
+            )
+        return await _fetch_completion(payload, key)
 
     except httpx.HTTPStatusError as e:
         logger.error(f"Error HTTP {e.response.status_code}: {e.response.text}")
@@ -115,6 +306,12 @@ async def chatbot_message(data: ChatRequest):
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail=f"Error en el servicio de IA: {e.response.text}",
         )
+    except NoProviderAvailable as e:
+        logger.error(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Ningún proveedor de IA disponible, inténtalo más tarde",
+        )
     except Exception as e:
         logger.exception("Error inesperado procesando la solicitud")
         raise HTTPException(
@@ -122,8 +319,341 @@ async def chatbot_message(data: ChatRequest):
             detail="Error interno procesando tu solicitud",
         )
 
+async def _relay_stream(payload: dict, model: str) -> AsyncIterator[str]:
+    """
+    Reenvía los fragmentos del proveedor como SSE sin acumular la respuesta.
+    Si se cierra el generador (el cliente se desconectó), se cierra también
+    la conexión con el proveedor y se cancela la generación.
+    """
+    try:
+        async for event in llm_router.stream(payload):
+            if "content" in event:
+                yield _sse({"content": event["content"]})
+            else:
+                yield _sse({"model_used": model, "tokens_used": event["tokens_used"]}, event="done")
+
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error HTTP {e.response.status_code}: {e.response.text}")
+        yield _sse({"detail": f"Error en el servicio de IA: {e.response.text}"}, event="error")
+    except NoProviderAvailable as e:
+        logger.error(str(e))
+        yield _sse({"detail": "Ningún proveedor de IA disponible, inténtalo más tarde"}, event="error")
+    except Exception:
+        logger.exception("Error durante el stream")
+        yield _sse({"detail": "Error de conexión con el servicio de IA"}, event="error")
+
+async def _charge(request: Request, tokens_used: Optional[int]) -> None:
+    """Descuenta los tokens usados del presupuesto del tenant."""
+    await admission.charge(getattr(request.state, "tenant", None), tokens_used)
+
+async def _client_stream(events: AsyncIterator[str], request: Request) -> AsyncIterator[str]:
+    try:
+        async for event in events:
+            if await request.is_disconnected():
+                logger.info("Cliente desconectado, cancelando stream")
+                return
+            yield event
+            if event.startswith("event: done"):
+                done = json.loads(event.split("data: ", 1)[1])
+                await _charge(request, done["tokens_used"])
+    finally:
+        await events.aclose()
+
+async def _replay_cached(cached: dict, model: str) -> AsyncIterator[str]:
+    yield _sse({"content": cached["reply"]})
+    yield _sse({"model_used": model, "tokens_used": cached["tokens_used"]}, event="done")
+
+# ========= Rutas =========
+@router.post("/message", response_model=ChatResponse)
+async def chatbot_message(data: ChatRequest, request: Request):
+    """
+    Envía mensajes a OpenRouter y devuelve la respuesta.
+    """
+    _ensure_configured()
+    data, cache = await _resolve_chat(data)
+    logger.info(f"Petición para modelo: {data.model}")
+
+    result = await _complete(await _build_payload(data), cache)
+    await _charge(request, result["tokens_used"])
+    return ChatResponse(model_used=data.model, **result)
+
+@router.post("/message/stream")
+async def chatbot_message_stream(data: ChatRequest, request: Request):
+    """
+    Igual que /message pero devuelve la respuesta como Server-Sent Events:
+    eventos `data: {"content": ...}` con cada fragmento y un evento final
+    `event: done` con model_used y tokens_used.
+    """
+    _ensure_configured()
+    data, cache = await _resolve_chat(data)
+    logger.info(f"Petición (stream) para modelo: {data.model}")
+
+    payload = await _build_payload(data)
+    key = _cache_key(payload, cache)
+    cached = await response_cache.get(key) if key is not None else None
+    if cached is not None:
+        events = _replay_cached(cached, data.model)
+    else:
+        if inflight is not None:
+            events = inflight.do_stream(
+                make_key({**payload, "stream": True}), lambda: _relay_stream(payload, data.model)
+            )
+        else:
+            events = _relay_stream(payload, data.model)
+
+    return StreamingResponse(
+        _client_stream(events, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _admit_item(tenant: str, bot_id: Optional[str]) -> None:
+    """
+    Admisión de un elemento del lote con los mismos límites que /message.
+    Si solo falta esperar al rate limit, se espera en vez de fallar, y si se
+    agota la espera en cola se vuelve a ella; todo en BATCH_ITEM_TIMEOUT.
+    """
+    deadline = time.monotonic() + BATCH_ITEM_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            await asyncio.wait_for(admission.admit(tenant, bot_id), remaining)
+            return
+        except asyncio.TimeoutError:
+            raise RateLimited("Tiempo de espera agotado", retry_after=1)
+        except QueueTimeout:
+            continue
+        except RateLimited as e:
+            if e.retry_after > deadline - time.monotonic():
+                raise
+            await asyncio.sleep(e.retry_after)
+
+async def _batch_item(index: int, data: ChatRequest, tenant: str, bot_id: Optional[str]) -> dict:
+    try:
+        with metrics.stage("admission"):
+            await _admit_item(tenant, bot_id)
+    except RateLimited as e:
+        return {"index": index, "error": e.detail, "status": 429, "retry_after": math.ceil(e.retry_after)}
+
+    try:
+        data, cache = await _resolve_chat(data)
+        result = await _complete(await _build_payload(data), cache)
+        # /batch no pasa por el middleware de admisión: se cobra al tenant del lote
+        await admission.charge(tenant, result["tokens_used"])
+        return {"index": index, **ChatResponse(model_used=data.model, **result).dict()}
+    except HTTPException as e:
+        return {"index": index, "error": e.detail, "status": e.status_code}
+    except Exception:
+        logger.exception("Error inesperado en un elemento del lote")
+        return {"index": index, "error": "Error interno procesando tu solicitud", "status": 500}
+    finally:
+        admission.release(tenant)
+
+async def _run_batch(data: BatchRequest, tenant: str, bot_id: Optional[str]) -> AsyncIterator[str]:
+    semaphore = asyncio.Semaphore(data.concurrency)
+
+    async def run(index: int, item: ChatRequest) -> dict:
+        async with semaphore:
+            return await _batch_item(index, item, tenant, bot_id)
+
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(data.requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+    finally:
+        # El cliente se desconectó: no seguir gastando tokens
+        for task in tasks:
+            task.cancel()
+
+@router.post("/batch")
+async def chatbot_batch(data: BatchRequest, request: Request):
+    """
+    Ejecuta varias peticiones de /message en paralelo (como mucho
+    `concurrency` a la vez) y devuelve NDJSON: una línea por petición según
+    terminan, con su `index` en el lote. Los errores de un elemento van en su
+    línea (`error`, `status`) y no cortan el lote.
+    """
+    _ensure_configured()
+    tenant = await tenant_for(request.scope)
+    logger.info(f"Lote de {len(data.requests)} peticiones para {tenant}")
+    return StreamingResponse(
+        _run_batch(data, tenant, bot_for(request.scope)),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+async def _owned_conversation(conversation_id: str, user: Dict) -> ConversationDB:
+    conversation = await conversations.get_conversation(conversation_id)
+    if conversation is None or conversation.user_id != user["id"]:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversación no encontrada")
+    return conversation
+
+@router.post("/conversations", response_model=ConversationDB)
+async def create_conversation(data: ConversationCreate, user: Dict = Depends(current_user)):
+    await _get_bot(data.bot_id)
+    return await conversations.create_conversation(user["id"], data.bot_id)
+
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageDB])
+async def conversation_messages(conversation_id: str, user: Dict = Depends(current_user)):
+    conversation = await _owned_conversation(conversation_id, user)
+    return await conversations.history(conversation.id)
+
+@router.post("/conversations/message", response_model=ConversationReply)
+async def conversation_message(
+    turn: ConversationTurn, request: Request, user: Dict = Depends(current_user)
+):
+    """
+    Como /message, pero el cliente solo manda el mensaje nuevo: el historial
+    se guarda en el servidor. Los dos mensajes del turno se guardan solo si
+    OpenRouter responde bien.
+    """
+    _ensure_configured()
+    conversation = await _owned_conversation(turn.conversation_id, user)
+
+    # Solo la ventana final (la cola en memoria): lo anterior ya está en el resumen
+    history = await conversations.history(conversation.id, limit=CONVERSATION_TAIL_SIZE)
+    offset = await conversations.count(conversation.id) - len(history)
+    messages = [ChatMessage(role=m.role, content=m.content) for m in history]
+    messages.append(ChatMessage(role="user", content=turn.content))
+
+    # El turno es un /message con el historial del servidor y la config del bot
+    data, bot = await _with_bot_config(ChatRequest(messages=messages), conversation.bot_id)
+    logger.info(f"Petición (conversación) para modelo: {data.model}")
+
+    # Los resúmenes de turnos antiguos también se cobran al tenant
+    payload = await _build_payload(
+        data, conversation_id=conversation.id, on_usage=lambda tokens: _charge(request, tokens), offset=offset
+    )
+    result = await _complete(payload, bot.cache)
+    await _charge(request, result["tokens_used"])
+
+    for role, content in (("user", turn.content), ("assistant", result["reply"])):
+        await conversations.append(
+            conversation.id,
+            user["id"],
+            MessageCreate(bot_id=conversation.bot_id, role=role, content=content),
+        )
+
+    return ConversationReply(conversation_id=conversation.id, model_used=data.model, **result)
+
+@router.put("/bots/{bot_id}")
+async def update_bot(bot_id: str, config: ChatbotConfig, user: Dict = Depends(current_user_strict)):
+    """Actualiza la configuración de un bot e invalida su entrada en la caché."""
+    row = await update_chatbot(bot_id, user["id"], {
+        "name": config.name,
+        "description": config.description,
+        "config": config.dict(exclude={"name", "description"}),
+    })
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot no encontrado")
+    bot_configs.invalidate(bot_id)
+    return row
+
 app.include_router(router)
 
+# ========= Métricas =========
+def _single(fn):
+    return lambda: [({}, fn())]
+
+def _per_pool(field: str):
+    return lambda: [({"upstream": name}, stats[field]) for name, stats in http_clients.pool_stats().items()]
+
+registry.callback("tubot_http_pool_in_flight", "Peticiones en vuelo por pool", _per_pool("in_flight"), ("upstream",))
+registry.callback(
+    "tubot_http_pool_connections_in_use",
+    "Conexiones con peticiones activas por pool",
+    _per_pool("connections_in_use"),
+    ("upstream",),
+)
+registry.callback(
+    "tubot_http_pool_utilisation",
+    "Ocupación del pool (conexiones en uso / máximo)",
+    _per_pool("utilisation"),
+    ("upstream",),
+)
+registry.callback(
+    "tubot_http_pool_requests_total", "Peticiones por pool", _per_pool("requests"), ("upstream",), type="counter"
+)
+registry.callback(
+    "tubot_http_pool_saturated_total",
+    "Peticiones que encontraron todas las conexiones del pool ocupadas",
+    _per_pool("saturated"),
+    ("upstream",),
+    type="counter",
+)
+registry.callback("tubot_admission_active", "Peticiones admitidas en curso", _single(lambda: admission.limiter.active))
+registry.callback("tubot_admission_queued", "Peticiones en cola", _single(lambda: admission.limiter.queued))
+registry.callback(
+    "tubot_admission_rejected_total", "Peticiones rechazadas (429)", _single(lambda: admission.rejected), type="counter"
+)
+registry.callback(
+    "tubot_admission_queue_wait_seconds",
+    "Espera en la cola de admisión",
+    _single(lambda: admission.queue_wait),
+    type="histogram",
+)
+registry.callback(
+    "tubot_router_hedged_total", "Peticiones con hedge", _single(lambda: llm_router.hedged), type="counter"
+)
+registry.callback(
+    "tubot_bot_config_hits_total", "Aciertos de la caché de bots", _single(lambda: bot_configs.hits), type="counter"
+)
+registry.callback(
+    "tubot_bot_config_misses_total", "Fallos de la caché de bots", _single(lambda: bot_configs.misses), type="counter"
+)
+if response_cache is not None:
+    registry.callback(
+        "tubot_response_cache_hits_total", "Aciertos de la caché de respuestas",
+        _single(lambda: response_cache.hits), type="counter",
+    )
+    registry.callback(
+        "tubot_response_cache_misses_total", "Fallos de la caché de respuestas",
+        _single(lambda: response_cache.misses), type="counter",
+    )
+    registry.callback(
+        "tubot_response_cache_bytes", "Bytes ocupados por la caché de respuestas",
+        _single(lambda: response_cache.stats()["bytes"]),
+    )
+if inflight is not None:
+    registry.callback(
+        "tubot_singleflight_in_flight", "Llamadas upstream compartidas en curso",
+        _single(lambda: inflight.stats()["in_flight"]),
+    )
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No autorizado")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+@app.get("/health/cache")
+def health_cache():
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+@app.get("/health/limits")
+def health_limits():
+    return admission.stats()
+
+@app.get("/health/providers")
+def health_providers():
+    return llm_router.stats()
+
+@app.get("/health/bots")
+def health_bots():
+    return bot_configs.stats()
+
+@app.get("/health/pools")
+def health_pools():
+    return http_clients.pool_stats()
+
+@app.get("/health/inflight")
+def health_inflight():
+    if inflight is None:
+        return {"enabled": False}
+    return {"enabled": True, **inflight.stats()}
@@ -0,0 +1,320 @@
+import bisect
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+# Buckets (segundos) para latencias
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets para etapas cortas (validación, auth, decode)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# Series por métrica; las combinaciones de labels nuevas a partir de aquí se
+# agrupan en "other" (el modelo lo elige el cliente y no queremos series infinitas)
+MAX_SERIES = 1000
+
+
+class Histogram:
+    """Histograma con buckets fijos al estilo Prometheus."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        cumulative, total = {}, 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            cumulative[str(bound)] = total
+        cumulative["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+# ========= Métricas con labels =========
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, series: dict, labels: dict) -> Labels:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        if key not in series and len(series) >= MAX_SERIES:
+            key = ("other",) * len(self.labelnames)
+        return key
+
+    def collect(self) -> Iterable[Tuple[Labels, object]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(self._values, labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        return self._values.items()
+
+
+class LabeledHistogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[Labels, Histogram] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(self._histograms, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def collect(self):
+        return self._histograms.items()
+
+
+class Callback(Metric):
+    """
+    Métrica que se lee al exportar. `fn` devuelve pares (labels, valor), donde
+    el valor es un número o un `Histogram`; así se exponen los contadores que ya
+    llevan la caché, el pool HTTP, el control de admisión, etc.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], Iterable[Tuple[dict, object]]],
+        labelnames: Sequence[str] = (),
+        type: str = "gauge",
+    ):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.type = type
+
+    def collect(self):
+        return [(tuple(str(labels.get(n, "")) for n in self.labelnames), value) for labels, value in self.fn()]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> LabeledHistogram:
+        return self.register(LabeledHistogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn, labelnames: Sequence[str] = (), type: str = "gauge") -> Callback:
+        return self.register(Callback(name, help, fn, labelnames, type))
+
+    def render(self) -> str:
+        """Formato de texto de Prometheus (0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for values, value in metric.collect():
+                if isinstance(value, Histogram):
+                    total = 0
+                    for bound, n in zip(value.buckets, value.counts):
+                        total += n
+                        labels = _format_labels(metric.labelnames + ("le",), values + (repr(float(bound)),))
+                        lines.append(f"{metric.name}_bucket{labels} {total}")
+                    labels = _format_labels(metric.labelnames + ("le",), values + ("+Inf",))
+                    lines.append(f"{metric.name}_bucket{labels} {value.count}")
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}_sum{labels} {_format_value(value.sum)}")
+                    lines.append(f"{metric.name}_count{labels} {value.count}")
+                else:
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "tubot_request_seconds", "Duración total de la petición", ("route", "method", "status")
+)
+STAGE_SECONDS = registry.histogram(
+    "tubot_stage_seconds",
+    "Duración de cada etapa de la petición",
+    ("route", "stage", "model", "upstream"),
+    buckets=FAST_BUCKETS + DEFAULT_BUCKETS[-5:],
+)
+UPSTREAM_SECONDS = registry.histogram(
+    "tubot_upstream_seconds", "Espera de la respuesta del proveedor de IA", ("upstream", "model")
+)
+UPSTREAM_RESPONSES = registry.counter(
+    "tubot_upstream_responses_total", "Respuestas del proveedor de IA por código", ("upstream", "status")
+)
+TOKENS = registry.counter("tubot_tokens_total", "Tokens de IA consumidos", ("upstream", "model"))
+
+
+# ========= Tiempos por petición =========
+class RequestTimings:
+    """Etapas de una petición; se comparte por contextvar con las tareas hijas."""
+
+    __slots__ = ("start", "stages", "model", "upstream")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.model = ""
+        self.upstream = ""
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("tubot_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Suma lo que tarda el bloque a la etapa `name` de la petición en curso."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def annotate(model: Optional[str] = None, upstream: Optional[str] = None) -> None:
+    """Fija los labels `model` / `upstream` de las etapas de la petición en curso."""
+    timings = _timings.get()
+    if timings is None:
+        return
+    if model is not None:
+        timings.model = model
+    if upstream is not None:
+        timings.upstream = upstream
+
+
+class TimedRoute(APIRoute):
+    """
+    Marca cuándo empieza el endpoint: lo que pasa antes (leer el body,
+    validarlo con Pydantic, resolver dependencias) y no tiene etapa propia
+    cuenta como "validation".
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = _timed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _timed(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        timings = _timings.get()
+        if timings is not None:
+            elapsed = time.perf_counter() - timings.start
+            timings.add("validation", max(0.0, elapsed - sum(timings.stages.values())))
+        return await endpoint(*args, **kwargs)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: mide cada petición, añade la cabecera Server-Timing y al
+    terminar (en streams, cuando se ha enviado el último fragmento) vuelca las
+    etapas en los histogramas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - timings.start, route=route, method=scope["method"], status=status
+            )
+            for name, seconds in timings.stages.items():
+                STAGE_SECONDS.observe(
+                    seconds, route=route, stage=name, model=timings.model, upstream=timings.upstream
+                )
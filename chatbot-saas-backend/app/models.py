@@ -1,5 +1,5 @@
 from __future__ import annotations
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Literal, Dict, Any
 from datetime import datetime
 
@@ -26,6 +26,9 @@ class ChatbotConfig(BaseModel):
     instructions: Optional[str] = Field(default="", max_length=1000)
     color: Optional[str] = Field(default="#00ffff", max_length=16)
     temperature: Optional[float] = Field(default=0.7, ge=0, le=1)
+    model: Optional[str] = Field(default="mistralai/mistral-7b-instruct", max_length=100)
+    # None: caché solo si es determinista / True: siempre / False: nunca
+    cache: Optional[bool] = None
 
 # ===== (Opcional) Modelos DB / mensajes =====
 class ChatbotDB(BaseModel):
@@ -49,3 +52,27 @@ class MessageDB(BaseModel):
     role: Literal["user", "assistant", "system"]
     content: str
     created_at: datetime
+    conversation_id: Optional[str] = None
+
+# ===== Conversaciones (historial en el servidor) =====
+class ConversationCreate(BaseModel):
+    bot_id: str
+
+class ConversationDB(BaseModel):
+    id: str
+    user_id: str
+    bot_id: str
+    created_at: datetime
+
+class ConversationTurn(BaseModel):
+    """
+    Un turno: solo el mensaje nuevo. El historial lo pone el servidor y el
+    modelo, las instrucciones y la temperatura salen del bot (422 si se mandan).
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    conversation_id: str
+    content: str
+
+class ConversationReply(ChatResponse):
+    conversation_id: str
@@ -1,65 +1,37 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional
-import logging
-from app.openrouter_client import OpenRouterClient
-
-# Inicializar FastAPI
-app = FastAPI()
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Inicializar Router y Cliente
-router = APIRouter(prefix="/chatbot", tags=["chatbot"])
-client = OpenRouterClient()
-
-# Modelos
-class ChatMessage(BaseModel):
-    role: str = Field(..., pattern="^(system|user|assistant)$")
-    content: str
-
-class ChatRequest(BaseModel):
-    messages: List[ChatMessage]
-    instructions: str = Field(default="", max_length=1000)
-    model: str = Field(default="mistralai/mistral-7b-instruct")
-
-class ChatResponse(BaseModel):
-    reply: str
-    model_used: str
-    tokens_used: Optional[int] = None
-
-# Endpoint principal
-@router.post("/message", response_model=ChatResponse)
-async def chatbot_message_route(data: ChatRequest):
-    try:
-        logger.info(f"Petición recibida para modelo: {data.model}")
-        response_data = await client.chat(
-            messages=[m.dict() for m in data.messages],
-            model=data.model,
-            instructions=data.instructions
-        )
+from typing import List, Union
+
+from pydantic import BaseModel
+
+from app.providers import llm_router
+
+
+class OpenRouterClient:
+    """
+    Cliente de compatibilidad para código antiguo. Ya no llama a OpenRouter
+    directamente: delega en el router de proveedores de app.providers.
+    Devuelve un dict con la forma de ChatResponse.
+    """
+
+    async def chat(
+        self,
+        messages: List[Union[dict, BaseModel]],
+        model: str = "mistralai/mistral-7b-instruct",
+        instructions: str = "",
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+    ) -> dict:
+        messages = [m if isinstance(m, dict) else m.dict() for m in messages]
+        if instructions:
+            messages = [{"role": "system", "content": instructions}] + messages
+
+        result = await llm_router.complete({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        })
         return {
-            "reply": response_data["choices"][0]["message"]["content"],
-            "model_used": data.model,
-            "tokens_used": response_data.get("usage", {}).get("total_tokens")
+            "reply": result["reply"],
+            "model_used": model,
+            "tokens_used": result["tokens_used"],
         }
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        logger.error(f"Error inesperado: {str(e)}")
-        raise HTTPException(status_code=500, detail="Error interno en el servidor")
-
-# Registrar router
-app.include_router(router)
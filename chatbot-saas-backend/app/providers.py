@@ -0,0 +1,559 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from app import http_clients, metrics
+
+logger = logging.getLogger("tubot.providers")
+
+# ========= Config =========
+FRONTEND_URL = os.getenv("FRONTEND_URL", "https://tu-bot.vercel.app")
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+# Mapas JSON {"modelo de TuBot": "modelo del proveedor"}; OpenRouter acepta cualquiera
+OPENAI_MODELS = json.loads(os.getenv("OPENAI_MODELS", "{}"))
+GROQ_MODELS = json.loads(os.getenv("GROQ_MODELS", "{}"))
+# Proveedor simulado para desarrollo sin red
+MOCK_PROVIDER = os.getenv("MOCK_PROVIDER", "0") == "1"
+
+ROUTER_HEDGING = os.getenv("ROUTER_HEDGING", "0") == "1"
+# El hedge se lanza tras el p95 del proveedor principal (como mínimo HEDGE_MIN_DELAY)
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+# Retardo cuando aún no hay datos de latencia
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "100"))
+# (proveedor, modelo) con estadísticas y breaker; el resto se olvida (LRU)
+ROUTER_MAX_BACKENDS = int(os.getenv("ROUTER_MAX_BACKENDS", "1000"))
+
+
+class ProviderError(Exception):
+    """Fallo del proveedor que justifica probar con otro."""
+
+
+class NoProviderAvailable(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (ProviderError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+# ========= Proveedores =========
+class Provider:
+    """
+    Un backend de chat completions. `complete` devuelve {reply, tokens_used};
+    `stream` emite {"content": ...} por fragmento y termina con {"tokens_used": ...}.
+    """
+
+    name: str
+
+    def supports(self, model: str) -> bool:
+        raise NotImplementedError
+
+    async def complete(self, payload: dict) -> dict:
+        raise NotImplementedError
+
+    def stream(self, payload: dict) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(Provider):
+    """OpenRouter, OpenAI y Groq hablan el mismo protocolo /chat/completions."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        api_key: str,
+        models: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        stream_options: Optional[dict] = None,
+    ):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.models = models
+        self.headers = headers or {}
+        # Campos extra para que el proveedor informe del uso al final del stream
+        self.stream_options = stream_options or {}
+
+    def supports(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def _payload(self, payload: dict) -> dict:
+        if self.models is None:
+            return payload
+        return {**payload, "model": self.models[payload["model"]]}
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            **self.headers,
+        }
+
+    def _record_response(self, model: str, status, waited: Optional[float] = None) -> None:
+        metrics.UPSTREAM_RESPONSES.inc(upstream=self.name, status=status)
+        if waited is not None:
+            metrics.record_stage("upstream", waited)
+            metrics.UPSTREAM_SECONDS.observe(waited, upstream=self.name, model=model)
+
+    def _record_tokens(self, model: str, tokens_used: Optional[int]) -> None:
+        if tokens_used:
+            metrics.TOKENS.inc(tokens_used, upstream=self.name, model=model)
+
+    async def _send(self, send, model: str):
+        metrics.annotate(upstream=self.name)
+        start = time.perf_counter()
+        try:
+            resp = await send()
+        except httpx.TransportError:
+            self._record_response(model, "error")
+            raise
+        self._record_response(model, resp.status_code, time.perf_counter() - start)
+        return resp
+
+    async def complete(self, payload: dict) -> dict:
+        model = payload["model"]
+        resp = await self._send(
+            lambda: http_clients.get_client(self.name).post(
+                self.url, headers=self._headers(), json=self._payload(payload)
+            ),
+            model,
+        )
+        resp.raise_for_status()
+        with metrics.stage("decode"):
+            j = resp.json()
+        tokens_used = (j.get("usage") or {}).get("total_tokens")
+        self._record_tokens(model, tokens_used)
+        return {
+            "reply": j["choices"][0]["message"]["content"],
+            "tokens_used": tokens_used,
+        }
+
+    async def stream(self, payload: dict) -> AsyncIterator[dict]:
+        model = payload["model"]
+        payload = {**self._payload(payload), "stream": True, **self.stream_options}
+        tokens_used = None
+        decode = 0.0
+        client = http_clients.get_client(self.name)
+        request = client.build_request("POST", self.url, headers=self._headers(), json=payload)
+        resp = await self._send(lambda: client.send(request, stream=True), model)
+        try:
+            if resp.status_code >= 400:
+                await resp.aread()
+                resp.raise_for_status()
+
+            async for line in resp.aiter_lines():
+                # Las líneas que empiezan por ":" son keep-alives
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[len("data:"):].strip()
+                if chunk == "[DONE]":
+                    break
+
+                start = time.perf_counter()
+                j = json.loads(chunk)
+                decode += time.perf_counter() - start
+                # Groq manda el uso en x_groq.usage
+                usage = j.get("usage") or (j.get("x_groq") or {}).get("usage")
+                if usage:
+                    tokens_used = usage.get("total_tokens")
+                for choice in j.get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield {"content": content}
+        finally:
+            await resp.aclose()
+            metrics.record_stage("decode", decode)
+
+        self._record_tokens(model, tokens_used)
+        yield {"tokens_used": tokens_used}
+
+
+class MockProvider(Provider):
+    """Proveedor simulado con latencia y tasa de errores configurables."""
+
+    def __init__(
+        self,
+        name: str = "mock",
+        reply: str = "Respuesta simulada",
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        models: Optional[List[str]] = None,
+    ):
+        self.name = name
+        self.reply = reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.models = models
+        self.calls = 0
+
+    def supports(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    async def _call(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise ProviderError(f"{self.name}: error simulado")
+
+    async def complete(self, payload: dict) -> dict:
+        await self._call()
+        return {"reply": self.reply, "tokens_used": len(self.reply.split())}
+
+    async def stream(self, payload: dict) -> AsyncIterator[dict]:
+        await self._call()
+        for word in self.reply.split(" "):
+            yield {"content": word + " "}
+        yield {"tokens_used": len(self.reply.split())}
+
+
+# ========= Salud de cada backend =========
+class LatencyStats:
+    """
+    Ventana deslizante de latencias y resultados de un (proveedor, modelo).
+    Los intentos cancelados (hedge perdido, cliente que se va) son muestras
+    censuradas: solo sabemos que habrían tardado más de lo que llevaban.
+    """
+
+    def __init__(self, window: int):
+        # (latencia, censurada)
+        self.latencies: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+    def record(self, latency: Optional[float], ok: Optional[bool]) -> None:
+        if latency is not None:
+            self.latencies.append((latency, False))
+        if ok is not None:
+            self.outcomes.append(ok)
+
+    def censor(self, lower_bound: float) -> None:
+        self.latencies.append((lower_bound, True))
+
+    @property
+    def censored(self) -> int:
+        return sum(1 for _, censored in self.latencies if censored)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(latency for latency, censored in self.latencies if not censored)
+        # Las censuradas van al final, como mínimo a su cota: no pueden bajar el
+        # percentil, y sin muestras completas lo que queda es la cota inferior
+        top = max(latency for latency, _ in self.latencies)
+        ordered += [top] * (len(self.latencies) - len(ordered))
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class CircuitBreaker:
+    """
+    Se abre tras `threshold` fallos seguidos. Pasado `cooldown` deja pasar una
+    única petición de prueba: si sale bien se cierra, si falla vuelve a abrirse.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.probing)
+
+    def begin(self) -> None:
+        if self.opened_at is not None:
+            self.probing = True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def abandon(self) -> None:
+        """La petición se canceló sin resultado."""
+        self.probing = False
+
+
+# ========= Router =========
+class Router:
+    """
+    Elige el backend más rápido y sano para cada modelo según su p50 y su
+    tasa de errores, hace failover ante errores recuperables y, si está
+    activado, lanza una petición de respaldo (hedge) al siguiente proveedor
+    cuando el principal supera su percentil de latencia.
+    """
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        hedging: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        hedge_default_delay: float = 5.0,
+        breaker_failures: int = 5,
+        breaker_cooldown: float = 30.0,
+        window: int = 100,
+        max_backends: int = 1000,
+    ):
+        self.providers = providers
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.window = window
+        self.max_backends = max_backends
+        # El modelo lo elige el cliente: solo se crean al intentar una petición
+        # y se olvidan los (proveedor, modelo) usados hace más tiempo
+        self._stats: "OrderedDict[Tuple[str, str], LatencyStats]" = OrderedDict()
+        self._breakers: "OrderedDict[Tuple[str, str], CircuitBreaker]" = OrderedDict()
+        self.hedged = 0
+
+    def _entry(self, table: OrderedDict, key: Tuple[str, str], factory):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = factory()
+            while len(table) > self.max_backends:
+                table.popitem(last=False)
+        table.move_to_end(key)
+        return entry
+
+    def _stats_for(self, provider: Provider, model: str) -> LatencyStats:
+        return self._entry(self._stats, (provider.name, model), lambda: LatencyStats(self.window))
+
+    def _breaker_for(self, provider: Provider, model: str) -> CircuitBreaker:
+        return self._entry(
+            self._breakers,
+            (provider.name, model),
+            lambda: CircuitBreaker(self.breaker_failures, self.breaker_cooldown),
+        )
+
+    def candidates(self, model: str) -> List[Provider]:
+        """Proveedores sanos para el modelo, del más rápido al más lento."""
+        def score(provider: Provider) -> float:
+            stats = self._stats.get((provider.name, model))
+            p50 = stats.quantile(0.5) if stats is not None else None
+            # Sin datos: 0, para que se pruebe (se respeta el orden de configuración)
+            return 0.0 if p50 is None else p50 * (1 + 4 * stats.error_rate)
+
+        def is_available(provider: Provider) -> bool:
+            breaker = self._breakers.get((provider.name, model))
+            return breaker is None or breaker.available()
+
+        available = [p for p in self.providers if p.supports(model) and is_available(p)]
+        return sorted(available, key=score)
+
+    async def _attempt(self, provider: Provider, payload: dict) -> dict:
+        model = payload["model"]
+        stats = self._stats_for(provider, model)
+        breaker = self._breaker_for(provider, model)
+        breaker.begin()
+        start = time.perf_counter()
+        try:
+            result = await provider.complete(payload)
+        except asyncio.CancelledError:
+            # Perdió el hedge (o el cliente se fue): lo que tardó es solo una cota inferior
+            stats.censor(time.perf_counter() - start)
+            breaker.abandon()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                logger.warning(f"{provider.name} falló con {model}: {e!r}")
+                stats.record(None, ok=False)
+                breaker.failure()
+            else:
+                # Error del cliente: el proveedor responde, no cuenta como caída
+                breaker.success()
+            raise
+        stats.record(time.perf_counter() - start, ok=True)
+        breaker.success()
+        return result
+
+    def _hedge_delay(self, provider: Provider, model: str) -> float:
+        q = self._stats_for(provider, model).quantile(self.hedge_quantile)
+        return self.hedge_default_delay if q is None else max(self.hedge_min_delay, q)
+
+    async def _hedged(self, primary: Provider, backup: Provider, payload: dict) -> dict:
+        tasks = [asyncio.create_task(self._attempt(primary, payload))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(primary, payload["model"]))
+            if done:
+                error = tasks[0].exception()
+                if error is None or not is_retryable(error):
+                    return tasks[0].result()
+                # Falló antes del retardo: vamos directamente al respaldo
+                return await self._attempt(backup, payload)
+
+            self.hedged += 1
+            logger.info(f"Hedge: {primary.name} tarda, lanzando {backup.name}")
+            tasks.append(asyncio.create_task(self._attempt(backup, payload)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not is_retryable(error):
+                        raise error
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def complete(self, payload: dict) -> dict:
+        candidates = self.candidates(payload["model"])
+        if not candidates:
+            raise NoProviderAvailable(f"Ningún proveedor disponible para {payload['model']}")
+
+        error: Optional[BaseException] = None
+        i = 0
+        while i < len(candidates):
+            hedge = self.hedging and i + 1 < len(candidates)
+            try:
+                if hedge:
+                    return await self._hedged(candidates[i], candidates[i + 1], payload)
+                return await self._attempt(candidates[i], payload)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+            i += 2 if hedge else 1
+        raise error
+
+    async def stream(self, payload: dict) -> AsyncIterator[dict]:
+        """
+        Failover solo antes del primer fragmento: una vez empezado el stream
+        no se puede cambiar de proveedor sin repetir texto.
+        """
+        model = payload["model"]
+        candidates = self.candidates(model)
+        if not candidates:
+            raise NoProviderAvailable(f"Ningún proveedor disponible para {model}")
+
+        for i, provider in enumerate(candidates):
+            stats = self._stats_for(provider, model)
+            breaker = self._breaker_for(provider, model)
+            breaker.begin()
+            started = False
+            start = time.perf_counter()
+            try:
+                async for event in provider.stream(payload):
+                    if not started:
+                        started = True
+                        # En streams, la latencia que cuenta es hasta el primer fragmento
+                        stats.record(time.perf_counter() - start, ok=None)
+                    yield event
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.success()
+                    raise
+                stats.record(None, ok=False)
+                breaker.failure()
+                if started or i == len(candidates) - 1:
+                    raise
+                logger.warning(f"{provider.name} falló con {model} ({e!r}), probando el siguiente")
+                continue
+            except BaseException:
+                if not started:
+                    stats.censor(time.perf_counter() - start)
+                breaker.abandon()
+                raise
+            stats.record(None, ok=True)
+            breaker.success()
+            return
+
+    def stats(self) -> dict:
+        backends = {}
+        for (name, model), stats in self._stats.items():
+            breaker = self._breakers.get((name, model))
+            backends[f"{name}:{model}"] = {
+                "p50": stats.quantile(0.5),
+                "p95": stats.quantile(0.95),
+                "censored": stats.censored,
+                "error_rate": stats.error_rate,
+                "breaker": breaker.state if breaker is not None else "closed",
+            }
+        return {"hedged": self.hedged, "backends": backends}
+
+
+def providers_from_env() -> List[Provider]:
+    providers: List[Provider] = []
+    if OPENROUTER_API_KEY:
+        providers.append(OpenAICompatibleProvider(
+            "openrouter",
+            OPENROUTER_URL,
+            OPENROUTER_API_KEY,
+            # OpenRouter recomienda referer + title para métricas/permit-list
+            headers={"HTTP-Referer": FRONTEND_URL, "X-Title": "TuBot"},
+            stream_options={"usage": {"include": True}},
+        ))
+    if OPENAI_API_KEY:
+        providers.append(OpenAICompatibleProvider(
+            "openai",
+            OPENAI_URL,
+            OPENAI_API_KEY,
+            models=OPENAI_MODELS,
+            stream_options={"stream_options": {"include_usage": True}},
+        ))
+    if GROQ_API_KEY:
+        providers.append(OpenAICompatibleProvider("groq", GROQ_URL, GROQ_API_KEY, models=GROQ_MODELS))
+    if MOCK_PROVIDER:
+        providers.append(MockProvider())
+    return providers
+
+
+llm_router = Router(
+    providers_from_env(),
+    hedging=ROUTER_HEDGING,
+    hedge_quantile=HEDGE_QUANTILE,
+    hedge_min_delay=HEDGE_MIN_DELAY,
+    hedge_default_delay=HEDGE_DEFAULT_DELAY,
+    breaker_failures=BREAKER_FAILURES,
+    breaker_cooldown=BREAKER_COOLDOWN,
+    window=LATENCY_WINDOW,
+    max_backends=ROUTER_MAX_BACKENDS,
+)
@@ -0,0 +1,345 @@
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from app import metrics
+from app.auth import InvalidToken, UnsupportedToken, verifier
+from app.metrics import Histogram
+
+logger = logging.getLogger("tubot.ratelimit")
+
+
+class RateLimited(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class QueueTimeout(RateLimited):
+    """Se agotó la espera en la cola de concurrencia (se puede volver a la cola)."""
+
+
+# ========= Backends =========
+class RateLimitBackend:
+    """
+    Estado de los límites por tenant. Implementar esta interfaz sobre un
+    almacén compartido (Redis...) para aplicar los límites entre workers.
+    """
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Consume un token del bucket; devuelve 0 o los segundos hasta el siguiente."""
+        raise NotImplementedError
+
+    async def spent(self, key: str, window: float) -> Tuple[int, float]:
+        """Tokens de IA gastados en la ventana actual y segundos hasta que se reinicia."""
+        raise NotImplementedError
+
+    async def spend(self, key: str, tokens: int, window: float) -> None:
+        raise NotImplementedError
+
+
+class InMemoryBackend(RateLimitBackend):
+    """
+    Backend en proceso (un solo worker, desarrollo y pruebas). Los buckets que
+    ya se han rellenado y las ventanas de gasto caducadas se descartan, y como
+    mucho se guardan `max_keys` tenants de cada tipo (se olvidan los más antiguos).
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # Ordenados de menos a más reciente (el último uso / el inicio de la ventana)
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self._spend: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        self._evict_buckets(now)
+        tokens, last, _ = self._buckets.get(key, (float(burst), now, now))
+        tokens = min(float(burst), tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+        else:
+            tokens -= 1
+        # (tokens, último uso, cuándo vuelve a estar lleno)
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        self._buckets.move_to_end(key)
+        return wait
+
+    def _evict_buckets(self, now: float) -> None:
+        # Un bucket lleno equivale a no tenerlo. Se miran los menos usados y se
+        # para en el primero que aún no se ha rellenado
+        while self._buckets:
+            key, (_, _, full_at) = next(iter(self._buckets.items()))
+            if now < full_at and len(self._buckets) < self.max_keys:
+                break
+            del self._buckets[key]
+
+    def _window(self, key: str, window: float, now: float) -> Tuple[float, int]:
+        start, used = self._spend.get(key, (now, 0))
+        if now - start >= window:
+            start, used = now, 0
+        return start, used
+
+    async def spent(self, key: str, window: float) -> Tuple[int, float]:
+        now = time.monotonic()
+        start, used = self._window(key, window, now)
+        return used, start + window - now
+
+    async def spend(self, key: str, tokens: int, window: float) -> None:
+        now = time.monotonic()
+        # Todas las ventanas duran lo mismo: por orden de inicio, las caducadas van primero
+        while self._spend:
+            oldest, (start, _) = next(iter(self._spend.items()))
+            if now - start < window and len(self._spend) < self.max_keys:
+                break
+            del self._spend[oldest]
+        start, used = self._window(key, window, now)
+        self._spend[key] = (start, used + tokens)
+
+
+# ========= Concurrencia con cola justa =========
+class FairLimiter:
+    """
+    Semáforo global con límite por tenant. Las peticiones que no caben esperan
+    en una cola FIFO por tenant, y los huecos se reparten por turnos entre
+    tenants para que uno ruidoso no acapare la cola.
+    """
+
+    def __init__(self, max_concurrency: int, per_tenant: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.per_tenant = per_tenant
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self._per_tenant: Dict[str, int] = {}
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    def _can_run(self, tenant: str) -> bool:
+        return self.active < self.max_concurrency and self._per_tenant.get(tenant, 0) < self.per_tenant
+
+    def _grant(self, tenant: str) -> None:
+        self.active += 1
+        self._per_tenant[tenant] = self._per_tenant.get(tenant, 0) + 1
+
+    async def acquire(self, tenant: str, timeout: float) -> None:
+        if tenant not in self._queues and self._can_run(tenant):
+            self._grant(tenant)
+            return
+        if self.queued >= self.max_queue:
+            raise RateLimited("Demasiadas peticiones en cola", retry_after=1)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append(fut)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done():
+                # Nos dieron el hueco justo al cancelar: devolverlo
+                self.release(tenant)
+            else:
+                fut.cancel()
+                self._drop(tenant, fut)
+            if isinstance(e, asyncio.TimeoutError):
+                raise QueueTimeout("Tiempo de espera en cola agotado", retry_after=timeout)
+            raise
+
+    def release(self, tenant: str) -> None:
+        self.active -= 1
+        self._per_tenant[tenant] -= 1
+        if not self._per_tenant[tenant]:
+            del self._per_tenant[tenant]
+        self._dispatch()
+
+    def _drop(self, tenant: str, fut: asyncio.Future) -> None:
+        queue = self._queues.get(tenant)
+        if queue is not None and fut in queue:
+            queue.remove(fut)
+            self.queued -= 1
+            if not queue:
+                del self._queues[tenant]
+
+    def _dispatch(self) -> None:
+        progress = True
+        while progress and self.active < self.max_concurrency:
+            progress = False
+            for tenant in list(self._queues):
+                if not self._can_run(tenant):
+                    continue
+                queue = self._queues[tenant]
+                fut = queue.popleft()
+                self.queued -= 1
+                if queue:
+                    self._queues.move_to_end(tenant)
+                else:
+                    del self._queues[tenant]
+                self._grant(tenant)
+                fut.set_result(None)
+                progress = True
+                break
+
+
+# ========= Control de admisión =========
+# Comprueba que un bot existe (se inyecta desde main, que tiene la caché de bots)
+BotExists = Callable[[str], Awaitable[bool]]
+
+
+class AdmissionController:
+    """Rate limit (token bucket), presupuesto de tokens de IA y concurrencia."""
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        rate: float,
+        burst: int,
+        token_budget: int,
+        budget_window: float,
+        limiter: FairLimiter,
+        queue_timeout: float,
+        bot_rate: float = 0,
+        bot_burst: int = 0,
+        bot_exists: Optional[BotExists] = None,
+    ):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        self.bot_exists = bot_exists
+        self.token_budget = token_budget
+        self.budget_window = budget_window
+        self.limiter = limiter
+        self.queue_timeout = queue_timeout
+        self.queue_wait = Histogram()
+        self.rejected = 0
+
+    async def admit(self, tenant: str, bot_id: Optional[str] = None) -> None:
+        """
+        Espera un hueco o lanza RateLimited. Hay que llamar a release() después.
+        Con `bot_id`, además del bucket del tenant se consume el del bot (si existe).
+        """
+        try:
+            if self.rate > 0:
+                wait = await self.backend.take(f"rate:{tenant}", self.rate, self.burst)
+                if wait > 0:
+                    raise RateLimited("Demasiadas peticiones", retry_after=wait)
+            # Después del bucket del tenant: un id inventado cuesta como mucho una
+            # consulta por petición admitida
+            if bot_id is not None and self.bot_rate > 0 and await self._bot_exists(bot_id):
+                wait = await self.backend.take(f"rate:bot:{bot_id}", self.bot_rate, self.bot_burst)
+                if wait > 0:
+                    raise RateLimited("Demasiadas peticiones para este bot", retry_after=wait)
+            if self.token_budget > 0:
+                used, reset_in = await self.backend.spent(f"spend:{tenant}", self.budget_window)
+                if used >= self.token_budget:
+                    raise RateLimited("Presupuesto de tokens agotado", retry_after=reset_in)
+
+            start = time.perf_counter()
+            await self.limiter.acquire(tenant, self.queue_timeout)
+            self.queue_wait.observe(time.perf_counter() - start)
+        except RateLimited:
+            self.rejected += 1
+            raise
+
+    async def _bot_exists(self, bot_id: str) -> bool:
+        if self.bot_exists is None:
+            return False
+        try:
+            return await self.bot_exists(bot_id)
+        except Exception:
+            logger.exception(f"No se pudo comprobar el bot {bot_id}")
+            return False
+
+    def release(self, tenant: str) -> None:
+        self.limiter.release(tenant)
+
+    async def charge(self, tenant: Optional[str], tokens: Optional[int]) -> None:
+        if tenant is None or not tokens or self.token_budget <= 0:
+            return
+        await self.backend.spend(f"spend:{tenant}", tokens, self.budget_window)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.limiter.active,
+            "queued": self.limiter.queued,
+            "rejected": self.rejected,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
+
+
+async def tenant_for(scope: dict) -> str:
+    """Usuario del JWT si lo hay; si no, la IP del cliente."""
+    headers = dict(scope.get("headers") or [])
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    if auth.lower().startswith("bearer ") and verifier.enabled:
+        try:
+            return f"user:{(await verifier.verify(auth[7:]))['sub']}"
+        except (InvalidToken, UnsupportedToken):
+            pass
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def bot_for(scope: dict) -> Optional[str]:
+    """
+    Bot de la cabecera X-Bot-Id. No está verificada: solo sirve para el
+    límite por bot, que se suma al del tenant. Los ids de bot son UUID.
+    """
+    headers = dict(scope.get("headers") or [])
+    try:
+        return str(uuid.UUID(headers.get(b"x-bot-id", b"").decode("latin-1")))
+    except ValueError:
+        return None
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI: aplica el control de admisión a las rutas indicadas y
+    deja el tenant en `request.state.tenant` para poder cobrar los tokens.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths: Tuple[str, ...]):
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            with metrics.stage("admission"):
+                tenant = await tenant_for(scope)
+                await self.controller.admit(tenant, bot_for(scope))
+        except RateLimited as e:
+            logger.warning(f"Petición rechazada para {tenant}: {e.detail}")
+            await _too_many_requests(send, e)
+            return
+
+        scope.setdefault("state", {})["tenant"] = tenant
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(tenant)
+
+
+async def _too_many_requests(send, error: RateLimited) -> None:
+    body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(error.retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..models import ChatRequest, ChatResponse
-from ..openrouter import OpenRouterClient
+from ..openrouter_client import OpenRouterClient
 
 router = APIRouter()
 
@@ -13,6 +13,7 @@ async def chatbot_message(
         response = await openrouter.chat(
             messages=request.messages,
             model=request.model,
+            instructions=request.instructions,
             temperature=request.temperature
         )
         return response
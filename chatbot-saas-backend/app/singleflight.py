@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger("tubot.singleflight")
+
+T = TypeVar("T")
+
+# Chunks en cola por suscriptor de un stream compartido
+STREAM_BUFFER = 64
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Stream:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        # Una cola acotada por suscriptor: el más lento frena al productor
+        self.queues: List[asyncio.Queue] = []
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_END = object()
+
+
+class SingleFlight:
+    """
+    Agrupa peticiones idénticas concurrentes en una sola llamada upstream.
+
+    La llamada corre en su propia tarea, así que si el cliente que la inició
+    (el "líder") se desconecta, los demás siguen esperando el resultado. Solo
+    se cancela cuando ya no queda nadie esperando.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Stream] = {}
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                logger.info("Sin clientes esperando, cancelando llamada upstream")
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+
+    async def do_stream(
+        self, key: str, factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """
+        Versión para streams: todos los suscriptores reciben los mismos chunks.
+        Solo se puede unir uno a un stream que aún no ha emitido nada, así no
+        hay que guardar lo ya enviado y la memoria por stream no crece con la
+        respuesta.
+        """
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = _Stream()
+            self._streams[key] = stream
+            stream.task = asyncio.create_task(self._pump(key, stream, factory))
+        else:
+            self.shared += 1
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+        stream.queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stream.queues.remove(queue)
+            # Vaciar la cola por si el productor está bloqueado esperando hueco
+            while not queue.empty():
+                queue.get_nowait()
+            if not stream.queues and not stream.task.done():
+                logger.info("Sin suscriptores, cancelando stream upstream")
+                self._forget(self._streams, key, stream)
+                stream.task.cancel()
+
+    async def _pump(self, key: str, stream: _Stream, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            started = False
+            async for chunk in factory():
+                if not started:
+                    # Emitido el primer chunk, las peticiones nuevas abren su propio stream
+                    started = True
+                    self._forget(self._streams, key, stream)
+                for queue in list(stream.queues):
+                    await queue.put(chunk)
+            end = _END
+        except Exception as e:
+            end = _Failure(e)
+        finally:
+            self._forget(self._streams, key, stream)
+        for queue in list(stream.queues):
+            await queue.put(end)
+
+    @staticmethod
+    def _forget(table: dict, key: str, value) -> None:
+        if table.get(key) is value:
+            del table[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams),
+            "shared": self.shared,
+        }
@@ -1,9 +1,13 @@
 import os
-import httpx
+import uuid
 from dotenv import load_dotenv
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from typing import Optional, Dict
 
+from app import http_clients, metrics
+from app.auth import InvalidToken, UnsupportedToken, user_from_claims, verifier
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -15,64 +19,142 @@ headers = {
     "Content-Type": "application/json"
 }
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials) -> Dict:
-    """Verifica el token JWT con Supabase y devuelve los datos del usuario"""
+async def get_current_user(credentials: HTTPAuthorizationCredentials, remote: bool = False) -> Dict:
+    """
+    Verifica el token JWT y devuelve los datos del usuario.
+    Por defecto se verifica en local (firma + exp); con remote=True se pregunta
+    siempre a Supabase, que además detecta sesiones revocadas.
+    """
     token = credentials.credentials
     if not token:
         raise HTTPException(status_code=401, detail="Token no proporcionado")
-    
+
+    if not remote and verifier.enabled:
+        try:
+            with metrics.stage("auth"):
+                return user_from_claims(await verifier.verify(token))
+        except InvalidToken:
+            raise HTTPException(status_code=401, detail="Token inválido")
+        except UnsupportedToken:
+            pass
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        with metrics.stage("auth"):
+            response = await http_clients.request(
+                "supabase",
+                "GET",
                 f"{SUPABASE_URL}/auth/v1/user",
-                headers={"Authorization": f"Bearer {token}"}
+                headers={"apikey": SUPABASE_API_KEY, "Authorization": f"Bearer {token}"}
             )
-            if response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Token inválido")
-            return response.json()
+        if response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Token inválido")
+        return response.json()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error al verificar el token")
 
+bearer = HTTPBearer()
+
+async def current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> Dict:
+    """Dependencia para rutas protegidas (verificación local)."""
+    return await get_current_user(credentials)
+
+async def current_user_strict(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> Dict:
+    """Dependencia para rutas sensibles a revocación (siempre contra Supabase)."""
+    return await get_current_user(credentials, remote=True)
+
 async def register_user(email: str, password: str):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{SUPABASE_URL}/auth/v1/signup",
-                headers=headers,
-                json={"email": email, "password": password}
-            )
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail=response.json().get("message", "Error en registro"))
-            return response.json()
+        response = await http_clients.request(
+            "supabase",
+            "POST",
+            f"{SUPABASE_URL}/auth/v1/signup",
+            headers=headers,
+            json={"email": email, "password": password}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail=response.json().get("message", "Error en registro"))
+        return response.json()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 async def login_user(email: str, password: str):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{SUPABASE_URL}/auth/v1/token?grant_type=password",
-                headers=headers,
-                json={"email": email, "password": password}
-            )
-            if response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Credenciales inválidas")
-            return response.json()
+        response = await http_clients.request(
+            "supabase",
+            "POST",
+            f"{SUPABASE_URL}/auth/v1/token?grant_type=password",
+            headers=headers,
+            json={"email": email, "password": password}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Credenciales inválidas")
+        return response.json()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 async def create_chatbot(user_id: str, name: str, description: str = ""):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{SUPABASE_URL}/rest/v1/chatbots",
-                headers=headers,
-                json={
-                    "user_id": user_id,
-                    "name": name,
-                    "description": description
-                }
-            )
-            return response.json()
+        response = await http_clients.request(
+            "supabase",
+            "POST",
+            f"{SUPABASE_URL}/rest/v1/chatbots",
+            headers=headers,
+            json={
+                "user_id": user_id,
+                "name": name,
+                "description": description
+            }
+        )
+        return response.json()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def get_chatbot(bot_id: str) -> Optional[Dict]:
+    """Fila del bot en Supabase o None si no existe"""
+    # Los ids son UUID: con cualquier otra cosa PostgREST responde 400
+    try:
+        uuid.UUID(bot_id)
+    except ValueError:
+        return None
+    try:
+        response = await http_clients.request(
+            "supabase",
+            "GET",
+            f"{SUPABASE_URL}/rest/v1/chatbots",
+            headers=headers,
+            params={"id": f"eq.{bot_id}", "select": "*"}
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail="Error al leer el chatbot")
+        rows = response.json()
+        return rows[0] if rows else None
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def update_chatbot(bot_id: str, user_id: str, config: Dict) -> Optional[Dict]:
+    """Actualiza un bot del usuario; None si no existe o no es suyo"""
+    try:
+        response = await http_clients.request(
+            "supabase",
+            "PATCH",
+            f"{SUPABASE_URL}/rest/v1/chatbots",
+            headers={**headers, "Prefer": "return=representation"},
+            params={"id": f"eq.{bot_id}", "user_id": f"eq.{user_id}"},
+            json=config
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail="Error al actualizar el chatbot")
+        rows = response.json()
+        return rows[0] if rows else None
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
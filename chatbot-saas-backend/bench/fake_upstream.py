@@ -0,0 +1,136 @@
+"""
+Sustituto local de OpenRouter y Supabase para el banco de carga.
+
+    uvicorn bench.fake_upstream:app --port 9100
+
+Variables de entorno:
+    FAKE_LATENCY      latencia base por petición en segundos (0.2)
+    FAKE_JITTER       variación aleatoria añadida a la latencia (0.05)
+    FAKE_TOKEN_DELAY  pausa entre fragmentos en modo stream (0.01)
+    FAKE_REPLY_TOKENS palabras por respuesta (40)
+    FAKE_ERROR_RATE   fracción de peticiones que devuelven 503 (0)
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_LATENCY = float(os.getenv("FAKE_LATENCY", "0.2"))
+FAKE_JITTER = float(os.getenv("FAKE_JITTER", "0.05"))
+FAKE_TOKEN_DELAY = float(os.getenv("FAKE_TOKEN_DELAY", "0.01"))
+FAKE_REPLY_TOKENS = int(os.getenv("FAKE_REPLY_TOKENS", "40"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+
+app = FastAPI(title="TuBot fake upstream")
+
+# Bots creados en memoria (los que no existen se inventan al leerlos)
+bots = {}
+
+
+async def _delay() -> None:
+    await asyncio.sleep(FAKE_LATENCY + random.uniform(0, FAKE_JITTER))
+
+
+def _failed() -> bool:
+    return random.random() < FAKE_ERROR_RATE
+
+
+def _prompt_tokens(payload: dict) -> int:
+    return sum(len(m.get("content", "").split()) for m in payload.get("messages", []))
+
+
+# ========= OpenRouter =========
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    await _delay()
+    if _failed():
+        return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=503)
+
+    words = [f"palabra{i}" for i in range(FAKE_REPLY_TOKENS)]
+    usage = {
+        "prompt_tokens": _prompt_tokens(payload),
+        "completion_tokens": len(words),
+        "total_tokens": _prompt_tokens(payload) + len(words),
+    }
+
+    if not payload.get("stream"):
+        return {
+            "id": uuid.uuid4().hex,
+            "model": payload["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": usage,
+        }
+
+    async def events():
+        yield ": OPENROUTER PROCESSING\n\n"
+        for word in words:
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(FAKE_TOKEN_DELAY)
+        yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# ========= Supabase =========
+def _claims(request: Request) -> dict:
+    """Claims del bearer sin verificar (el banco ya firma tokens válidos)."""
+    token = request.headers.get("authorization", "").split(" ")[-1]
+    try:
+        body = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    except (IndexError, ValueError):
+        return {}
+
+
+@app.get("/auth/v1/user")
+async def auth_user(request: Request):
+    claims = _claims(request)
+    if "sub" not in claims:
+        return JSONResponse({"message": "invalid token"}, status_code=401)
+    return {"id": claims["sub"], "aud": claims.get("aud"), "email": claims.get("email")}
+
+
+@app.get("/auth/v1/.well-known/jwks.json")
+async def jwks():
+    return {"keys": []}
+
+
+def _bot(bot_id: str) -> dict:
+    if bot_id not in bots:
+        bots[bot_id] = {
+            "id": bot_id,
+            "user_id": "bench",
+            "name": f"Bot {bot_id[:8]}",
+            "description": "Bot del banco de carga",
+            "config": {"instructions": "Responde en español, claro y corto.", "temperature": 0.7},
+        }
+    return bots[bot_id]
+
+
+@app.get("/rest/v1/chatbots")
+async def get_chatbots(request: Request):
+    bot_id = request.query_params.get("id", "")[len("eq."):]
+    return [_bot(bot_id)] if bot_id else list(bots.values())
+
+
+@app.post("/rest/v1/chatbots")
+async def create_chatbot(request: Request):
+    row = {"id": uuid.uuid4().hex, "config": {}, **(await request.json())}
+    bots[row["id"]] = row
+    return JSONResponse([row], status_code=201)
+
+
+@app.patch("/rest/v1/chatbots")
+async def update_chatbot(request: Request):
+    bot_id = request.query_params.get("id", "")[len("eq."):]
+    row = _bot(bot_id)
+    row.update(await request.json())
+    return [row]
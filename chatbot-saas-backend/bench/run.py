@@ -0,0 +1,390 @@
+"""
+Banco de carga y latencia de la API.
+
+    python -m bench.run --concurrency 20 --turns 5
+    python -m bench.run --scenario stream --latency 0.5 --error-rate 0.05
+
+Arranca bench.fake_upstream (OpenRouter + Supabase falsos) y app.main con
+uvicorn, simula usuarios con conversaciones de varios turnos y mide
+throughput, latencia p50/p95/p99, time-to-first-token y memoria por
+conexión. Cada ejecución se guarda en bench/results/ con el commit actual
+y se compara con la ejecución anterior con la misma configuración.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.auth import sign_hs256  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+JWT_SECRET = "bench-secret"
+SCENARIOS = ("message", "stream", "conversation")
+
+
+# ========= Procesos =========
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(target: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+async def _wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} no arrancó a tiempo")
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """RSS del proceso (Linux); None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _git_commit() -> Dict[str, object]:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+
+
+# ========= Medidas =========
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ttft: List[float] = []
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    def summary(self) -> dict:
+        elapsed = self.finished - self.started
+        ok = len(self.latencies)
+        summary = {
+            "requests": ok + self.errors,
+            "errors": self.errors,
+            "throughput_rps": ok / elapsed if elapsed > 0 else None,
+            "latency_p50": percentile(self.latencies, 0.50),
+            "latency_p95": percentile(self.latencies, 0.95),
+            "latency_p99": percentile(self.latencies, 0.99),
+        }
+        if self.ttft:
+            summary.update({
+                "ttft_p50": percentile(self.ttft, 0.50),
+                "ttft_p95": percentile(self.ttft, 0.95),
+                "ttft_p99": percentile(self.ttft, 0.99),
+            })
+        return summary
+
+
+# ========= Usuarios simulados =========
+def _headers(user_id: str) -> Dict[str, str]:
+    token = sign_hs256(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 3600},
+        JWT_SECRET,
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _question(user: int, turn: int) -> str:
+    # Textos distintos por usuario para no medir solo la caché / single-flight
+    return f"Usuario {user}, pregunta {turn}: ¿cuál es el horario de atención y cómo contacto con soporte?"
+
+
+async def _timed(rec: Recorder, coro) -> None:
+    start = time.perf_counter()
+    try:
+        await coro
+    except Exception:
+        rec.errors += 1
+        return
+    rec.latencies.append(time.perf_counter() - start)
+
+
+async def _user_message(client: httpx.AsyncClient, user: int, turns: int, rec: Recorder) -> None:
+    """Cliente sin estado: reenvía todo el historial en cada turno."""
+    headers = _headers(f"bench-user-{user}")
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": _question(user, turn)})
+
+        async def call():
+            resp = await client.post(
+                "/chatbot/message",
+                headers=headers,
+                json={"bot_id": f"bench-bot-{user}", "messages": messages},
+            )
+            resp.raise_for_status()
+            messages.append({"role": "assistant", "content": resp.json()["reply"]})
+
+        await _timed(rec, call())
+
+
+async def _user_stream(client: httpx.AsyncClient, user: int, turns: int, rec: Recorder) -> None:
+    headers = _headers(f"bench-user-{user}")
+    for turn in range(turns):
+        start = time.perf_counter()
+        first = None
+        try:
+            async with client.stream(
+                "POST",
+                "/chatbot/message/stream",
+                headers=headers,
+                json={"bot_id": f"bench-bot-{user}", "messages": [{"role": "user", "content": _question(user, turn)}]},
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if line.startswith("event: error"):
+                        raise RuntimeError("error en el stream")
+                    if first is None and line.startswith("data:"):
+                        first = time.perf_counter() - start
+        except Exception:
+            rec.errors += 1
+            continue
+        rec.latencies.append(time.perf_counter() - start)
+        if first is not None:
+            rec.ttft.append(first)
+
+
+async def _user_conversation(client: httpx.AsyncClient, user: int, turns: int, rec: Recorder) -> None:
+    """Historial en el servidor: solo se manda el mensaje nuevo."""
+    headers = _headers(f"bench-user-{user}")
+    resp = await client.post("/chatbot/conversations", headers=headers, json={"bot_id": f"bench-bot-{user}"})
+    if resp.status_code != 200:
+        rec.errors += turns
+        return
+    conversation_id = resp.json()["id"]
+
+    for turn in range(turns):
+        async def call():
+            resp = await client.post(
+                "/chatbot/conversations/message",
+                headers=headers,
+                json={"conversation_id": conversation_id, "content": _question(user, turn)},
+            )
+            resp.raise_for_status()
+
+        await _timed(rec, call())
+
+
+USERS = {
+    "message": _user_message,
+    "stream": _user_stream,
+    "conversation": _user_conversation,
+}
+
+
+async def run_scenario(name: str, base_url: str, app_pid: int, concurrency: int, turns: int) -> dict:
+    rec = Recorder()
+    idle_rss = _rss_bytes(app_pid)
+    peak_rss = idle_rss
+    done = asyncio.Event()
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while not done.is_set():
+            rss = _rss_bytes(app_pid)
+            if rss is not None and (peak_rss is None or rss > peak_rss):
+                peak_rss = rss
+            await asyncio.sleep(0.1)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        sampler = asyncio.create_task(sample_memory())
+        rec.started = time.perf_counter()
+        await asyncio.gather(*[USERS[name](client, user, turns, rec) for user in range(concurrency)])
+        rec.finished = time.perf_counter()
+        done.set()
+        await sampler
+
+    summary = rec.summary()
+    if idle_rss is not None and peak_rss is not None:
+        summary["rss_idle_bytes"] = idle_rss
+        summary["rss_peak_bytes"] = peak_rss
+        summary["memory_per_connection_bytes"] = (peak_rss - idle_rss) / concurrency
+    return summary
+
+
+# ========= Resultados =========
+def _previous(config: dict) -> Optional[dict]:
+    if not RESULTS_DIR.exists():
+        return None
+    for path in sorted(RESULTS_DIR.glob("*.json"), reverse=True):
+        result = json.loads(path.read_text())
+        if result.get("config") == config:
+            return result
+    return None
+
+
+def _compare(current: dict, previous: dict, threshold: float) -> List[str]:
+    """Devuelve las regresiones (métrica peor que la anterior en más de `threshold`)."""
+    regressions = []
+    print(f"\nComparado con {previous['commit']} ({previous['timestamp']}):")
+    for name, summary in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in (
+            ("throughput_rps", True), ("latency_p95", False), ("ttft_p95", False),
+            ("memory_per_connection_bytes", False),
+        ):
+            now, then = summary.get(metric), before.get(metric)
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            worse = -change if higher_is_better else change
+            flag = "  REGRESIÓN" if worse > threshold else ""
+            print(f"  {name:13s} {metric:28s} {then:12.4f} -> {now:12.4f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def _print_summary(name: str, summary: dict) -> None:
+    def ms(v):
+        return f"{v * 1000:8.1f}ms" if v is not None else "       -"
+    print(
+        f"{name:13s} {summary['requests']:6d} req {summary['errors']:4d} err "
+        f"{summary['throughput_rps'] or 0:8.1f} req/s  "
+        f"p50 {ms(summary['latency_p50'])} p95 {ms(summary['latency_p95'])} p99 {ms(summary['latency_p99'])}"
+        + (f"  ttft p50 {ms(summary['ttft_p50'])}" if "ttft_p50" in summary else "")
+        + (f"  mem/conn {summary['memory_per_connection_bytes'] / 1024:8.1f}KiB"
+           if "memory_per_connection_bytes" in summary else "")
+    )
+
+
+async def main(args: argparse.Namespace) -> int:
+    fake_port, app_port = _free_port(), _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    tmp = tempfile.mkdtemp(prefix="tubot-bench-")
+
+    fake_env = {
+        **os.environ,
+        "FAKE_LATENCY": str(args.latency),
+        "FAKE_JITTER": str(args.jitter),
+        "FAKE_TOKEN_DELAY": str(args.token_delay),
+        "FAKE_REPLY_TOKENS": str(args.reply_tokens),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+    }
+    app_env = {
+        **os.environ,
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_URL": f"{fake_url}/api/v1/chat/completions",
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_API_KEY": "bench",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "CONVERSATION_STORE_URL": f"sqlite:///{tmp}/conversations.db",
+        # El banco mide la app, no los límites por tenant
+        "RATE_LIMIT_RPS": "0",
+        "MAX_CONCURRENCY": str(max(64, args.concurrency * 2)),
+        "MAX_CONCURRENCY_PER_TENANT": str(max(4, args.concurrency)),
+        "MAX_QUEUE": str(max(256, args.concurrency * 4)),
+    }
+
+    fake = _start("bench.fake_upstream:app", fake_port, fake_env)
+    app = _start("app.main:app", app_port, app_env)
+    try:
+        await _wait_ready(f"{fake_url}/auth/v1/.well-known/jwks.json")
+        await _wait_ready(f"{app_url}/health")
+
+        scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+        config = {
+            "concurrency": args.concurrency,
+            "turns": args.turns,
+            "latency": args.latency,
+            "token_delay": args.token_delay,
+            "reply_tokens": args.reply_tokens,
+            "error_rate": args.error_rate,
+            "scenarios": list(scenarios),
+        }
+        result = {
+            **_git_commit(),
+            "timestamp": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+            "config": config,
+            "scenarios": {},
+        }
+
+        # Calienta conexiones, imports perezosos y cachés antes de medir
+        await run_scenario("message", app_url, app.pid, args.concurrency, 1)
+
+        print(f"Concurrencia {args.concurrency}, {args.turns} turnos por usuario\n")
+        for name in scenarios:
+            summary = await run_scenario(name, app_url, app.pid, args.concurrency, args.turns)
+            result["scenarios"][name] = summary
+            _print_summary(name, summary)
+
+        previous = _previous(config)
+        regressions = _compare(result, previous, args.threshold) if previous else []
+
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{result['timestamp']}-{result['commit'] or 'nogit'}.json"
+        path.write_text(json.dumps(result, indent=2))
+        print(f"\nResultados guardados en {path.relative_to(ROOT)}")
+
+        if regressions and args.fail_on_regression:
+            return 1
+        return 0
+    finally:
+        for proc in (app, fake):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Banco de carga de TuBot")
+    parser.add_argument("--scenario", choices=("all",) + SCENARIOS, default="all")
+    parser.add_argument("--concurrency", type=int, default=20, help="usuarios simultáneos")
+    parser.add_argument("--turns", type=int, default=5, help="turnos por usuario")
+    parser.add_argument("--latency", type=float, default=0.2, help="latencia del upstream falso (s)")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="pausa entre fragmentos en stream (s)")
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de 503 del upstream")
+    parser.add_argument("--threshold", type=float, default=0.10, help="empeoramiento que cuenta como regresión")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
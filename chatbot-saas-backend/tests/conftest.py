@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# La app lee su configuración del entorno al importarse
+os.environ.setdefault("CONVERSATION_STORE_URL", "sqlite:///:memory:")
+os.environ.setdefault("HTTP2_ENABLED", "0")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
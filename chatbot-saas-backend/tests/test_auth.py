@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+
+from app.auth import InvalidToken, JWTVerifier, UnsupportedToken, sign_hs256
+
+SECRET = "test-secret"
+
+
+def _claims(**overrides):
+    claims = {"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 600}
+    claims.update(overrides)
+    return claims
+
+
+def _segment(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+
+
+def _verify(token: str, verifier: JWTVerifier = None) -> dict:
+    return asyncio.run((verifier or JWTVerifier(secret=SECRET)).verify(token))
+
+
+def test_valid_token():
+    claims = _verify(sign_hs256(_claims(), SECRET))
+    assert claims["sub"] == "user-1"
+
+
+def test_expired_token():
+    with pytest.raises(InvalidToken):
+        _verify(sign_hs256(_claims(exp=int(time.time()) - 3600), SECRET))
+
+
+def test_not_yet_valid_token():
+    with pytest.raises(InvalidToken):
+        _verify(sign_hs256(_claims(nbf=int(time.time()) + 3600), SECRET))
+
+
+def test_wrong_signature():
+    with pytest.raises(InvalidToken):
+        _verify(sign_hs256(_claims(), "otro-secreto"))
+
+
+def test_wrong_audience():
+    with pytest.raises(InvalidToken):
+        _verify(sign_hs256(_claims(aud="anon"), SECRET))
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "abc",
+    "a.b",
+    "W10.e30.xx",
+    f"{_segment({'alg': 'HS256'})}.{_segment([])}.xx",
+    f"{_segment({'alg': 'HS256'})}.no-es-base64!.xx",
+    f"{_segment({'alg': 'none'})}.{_segment(_claims())}.",
+    f"{_segment({'alg': 'RS256', 'kid': []})}.{_segment(_claims())}.xx",
+])
+def test_malformed_tokens(token):
+    with pytest.raises(InvalidToken):
+        _verify(token)
+
+
+@pytest.mark.parametrize("claims", [
+    _claims(exp="mañana"),
+    _claims(exp=True),
+    _claims(nbf="ayer"),
+    _claims(sub=123),
+    {"sub": "user-1", "aud": "authenticated"},
+])
+def test_invalid_claims(claims):
+    with pytest.raises(InvalidToken):
+        _verify(sign_hs256(claims, SECRET))
+
+
+def test_hs256_without_secret_is_unsupported():
+    with pytest.raises(UnsupportedToken):
+        _verify(sign_hs256(_claims(), SECRET), JWTVerifier(jwks_url="http://jwks.invalid"))
+
+
+def test_cache_never_outlives_exp():
+    verifier = JWTVerifier(secret=SECRET, cache_ttl=3600)
+    exp = time.time() + 600
+    _verify(sign_hs256(_claims(exp=exp), SECRET), verifier)
+    [(expires_at, _)] = verifier._cache.values()
+    assert expires_at == exp
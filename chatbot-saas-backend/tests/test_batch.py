@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app import main
+from app.providers import MockProvider
+from app.ratelimit import FairLimiter, InMemoryBackend
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Presupuesto de 5 tokens, sin rate limit, y un proveedor que gasta 3 por respuesta."""
+    monkeypatch.setattr(main.admission, "backend", InMemoryBackend())
+    monkeypatch.setattr(main.admission, "rate", 0)
+    monkeypatch.setattr(main.admission, "token_budget", 5)
+    monkeypatch.setattr(main.llm_router, "providers", [MockProvider("mock", reply="uno dos tres")])
+    return main.admission
+
+
+def _batch(items: int, concurrency: int = 1) -> list:
+    body = {
+        "requests": [{"messages": [{"role": "user", "content": f"pregunta {i}"}]} for i in range(items)],
+        "concurrency": concurrency,
+    }
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/chatbot/batch", json=body)
+            assert response.status_code == 200
+            return [json.loads(line) for line in response.text.splitlines()]
+
+    return asyncio.run(run())
+
+
+def _spent(admission) -> int:
+    used, _ = asyncio.run(admission.backend.spent("spend:ip:127.0.0.1", admission.budget_window))
+    return used
+
+
+def test_batch_items_are_charged_to_tenant(budget):
+    lines = _batch(1)
+    assert lines[0]["tokens_used"] == 3
+    assert _spent(budget) == 3
+
+
+def test_batch_stops_when_budget_is_spent(budget):
+    lines = sorted(_batch(3), key=lambda line: line["index"])
+    assert [line.get("status") for line in lines] == [None, None, 429]
+    assert _spent(budget) == 6
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    """Un solo hueco por tenant, ocupado desde fuera del lote."""
+    limiter = FairLimiter(max_concurrency=10, per_tenant=1, max_queue=10)
+    monkeypatch.setattr(main.admission, "limiter", limiter)
+    monkeypatch.setattr(main.admission, "rate", 0)
+    monkeypatch.setattr(main.admission, "queue_timeout", 0.2)
+    monkeypatch.setattr(main.llm_router, "providers", [MockProvider("mock")])
+    return limiter
+
+
+def _hold(limiter: FairLimiter, seconds: float):
+    """Ocupa el hueco del tenant del test durante `seconds`."""
+    async def hold():
+        await limiter.acquire("ip:127.0.0.1", 1)
+        await asyncio.sleep(seconds)
+        limiter.release("ip:127.0.0.1")
+
+    return hold()
+
+
+def _timed_batch(limiter: FairLimiter, hold_seconds: float) -> tuple:
+    body = {"requests": [{"messages": [{"role": "user", "content": "hola"}]}]}
+
+    async def run():
+        holder = asyncio.create_task(_hold(limiter, hold_seconds))
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/chatbot/batch", json=body)
+        elapsed = time.perf_counter() - start
+        holder.cancel()
+        return json.loads(response.text.splitlines()[0]), elapsed
+
+    return asyncio.run(run())
+
+
+def test_queue_timeout_requeues_immediately(one_slot):
+    # La espera en cola (0.2s) se agota antes de que se libere el hueco (0.25s)
+    line, elapsed = _timed_batch(one_slot, 0.25)
+    assert "error" not in line
+    assert elapsed < 0.38
+
+
+def test_item_admission_has_a_deadline(one_slot, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_ITEM_TIMEOUT", 0.3)
+    line, elapsed = _timed_batch(one_slot, 5)
+    assert line["status"] == 429
+    assert elapsed < 1
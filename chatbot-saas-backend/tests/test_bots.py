@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.bots import BotConfigCache
+
+
+def _cache(rows: dict, calls: list, **options) -> BotConfigCache:
+    async def load(bot_id):
+        calls.append(bot_id)
+        if bot_id == "broken":
+            raise HTTPException(status_code=502, detail="Error al leer el chatbot")
+        return rows.get(bot_id)
+
+    return BotConfigCache(load, **options)
+
+
+def test_missing_bots_are_cached():
+    calls = []
+    cache = _cache({}, calls)
+
+    async def run():
+        for _ in range(5):
+            assert await cache.get("missing") is None
+
+    asyncio.run(run())
+    assert calls == ["missing"]
+
+
+def test_load_errors_are_cached_and_raised():
+    calls = []
+    cache = _cache({}, calls)
+
+    async def run():
+        for _ in range(5):
+            with pytest.raises(HTTPException):
+                await cache.get("broken")
+
+    asyncio.run(run())
+    assert calls == ["broken"]
+
+
+def test_missing_bots_do_not_evict_real_ones():
+    calls = []
+    cache = _cache({"real": {"id": "real", "name": "Bot"}}, calls, max_entries=10, max_negative_entries=10)
+
+    async def run():
+        await cache.get("real")
+        for i in range(100):
+            await cache.get(f"missing-{i}")
+        return await cache.get("real")
+
+    assert asyncio.run(run()).id == "real"
+    assert calls.count("real") == 1
+    assert cache.stats()["negative_entries"] == 10
+
+
+def test_invalidate_forgets_negative_entries():
+    calls = []
+    rows = {}
+    cache = _cache(rows, calls)
+    asyncio.run(cache.get("new"))
+    rows["new"] = {"id": "new", "name": "Bot"}
+    cache.invalidate("new")
+    assert asyncio.run(cache.get("new")).id == "new"
@@ -0,0 +1,109 @@
+import asyncio
+
+from app.context import SUMMARY_HEADER, ContextBuilder, InMemorySummaries, _openai_encoding, count_tokens
+
+TAIL_SIZE = 10
+MODEL = "mistralai/mistral-7b-instruct"
+
+
+class Summarizer:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+
+    async def __call__(self, previous: str, messages: list, model: str):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("proveedor caído")
+        return f"{previous} +{len(messages)}".strip(), 7
+
+
+def _converse(builder: ContextBuilder, store: InMemorySummaries, turns: int) -> list:
+    """
+    Simula /conversations/message: cada turno lee solo la cola del historial
+    (como mucho TAIL_SIZE mensajes) y guarda la pregunta y la respuesta.
+    Devuelve, por turno, (offset, upto antes de construir, mensajes enviados).
+    """
+    history: list = []
+    charged: list = []
+
+    async def on_usage(tokens):
+        charged.append(tokens)
+
+    async def run():
+        log = []
+        for turn in range(turns):
+            window = history[-TAIL_SIZE:]
+            offset = len(history) - len(window)
+            upto, _ = await store.get_summary("c")
+            messages = window + [{"role": "user", "content": f"pregunta {turn}"}]
+            system, sent = await builder.build(
+                "Eres un bot.", messages, MODEL, "c", on_usage,
+                offset=offset, max_messages=TAIL_SIZE - 1,
+            )
+            log.append((offset, upto, system, sent))
+            history.extend([messages[-1], {"role": "assistant", "content": f"respuesta {turn}"}])
+        return log
+
+    return asyncio.run(run()), charged
+
+
+def test_long_conversation_folds_in_batches():
+    store = InMemorySummaries()
+    summarizer = Summarizer()
+    builder = ContextBuilder(budget=3000, summarizer=summarizer, store=store)
+    turns = 40
+    log, charged = _converse(builder, store, turns)
+
+    # Se pliega de vez en cuando, no en cada turno
+    assert 0 < summarizer.calls <= turns // 2
+    assert charged == [7] * summarizer.calls
+    for offset, upto, system, sent in log:
+        # Lo que queda fuera de la ventana leída ya estaba resumido
+        assert upto >= offset
+        assert len(sent) <= TAIL_SIZE
+        assert sent[-1]["role"] == "user"
+    # Resumen + mensajes enviados cubren toda la conversación, sin huecos
+    upto, _ = asyncio.run(store.get_summary("c"))
+    offset, _, system, sent = log[-1]
+    assert SUMMARY_HEADER in system
+    assert upto + len(sent) == 2 * (turns - 1) + 1
+
+
+def test_short_conversation_is_not_summarized():
+    store = InMemorySummaries()
+    summarizer = Summarizer()
+    builder = ContextBuilder(budget=3000, summarizer=summarizer, store=store)
+    log, _ = _converse(builder, store, TAIL_SIZE // 2)
+    assert summarizer.calls == 0
+    assert len(log[-1][3]) == 2 * (TAIL_SIZE // 2 - 1) + 1
+
+
+def test_summarizer_failure_drops_old_turns():
+    store = InMemorySummaries()
+    summarizer = Summarizer(fail=True)
+    builder = ContextBuilder(budget=3000, summarizer=summarizer, store=store)
+    log, charged = _converse(builder, store, 20)
+
+    assert summarizer.calls > 0
+    assert charged == []
+    for _, _, system, sent in log:
+        assert SUMMARY_HEADER not in system
+        assert len(sent) <= TAIL_SIZE - 1
+    assert asyncio.run(store.get_summary("c")) == (0, "")
+
+
+def test_token_budget_cuts_without_conversation():
+    builder = ContextBuilder(budget=50)
+    messages = [{"role": "user", "content": "palabra " * 20} for _ in range(10)]
+    system, sent = asyncio.run(builder.build("Eres un bot.", messages, MODEL))
+    assert system == "Eres un bot."
+    assert 0 < len(sent) < len(messages)
+    assert sent[-1] is messages[-1]
+
+
+def test_tokenizer_cache_is_bounded():
+    for i in range(300):
+        count_tokens("hola", f"modelo-{i}")
+        count_tokens("hola", f"openai/modelo-{i}")
+    assert _openai_encoding.cache_info().currsize <= 32
@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import main
+from app.cache import ResponseCache
+from app.providers import MockProvider
+from app.supabase_client import current_user, current_user_strict
+
+
+def _bot_row(bot_id: str, **config) -> dict:
+    return {"id": bot_id, "name": "Bot", "config": {"model": "m", "temperature": 0, **config}}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """App con proveedor simulado, caché de respuestas y bots en memoria."""
+    rows = {
+        "cached": _bot_row("cached"),
+        "opted-out": _bot_row("opted-out", cache=False),
+    }
+
+    async def load(bot_id):
+        return rows.get(bot_id)
+
+    provider = MockProvider("mock", reply="hola")
+    monkeypatch.setattr(main.llm_router, "providers", [provider])
+    monkeypatch.setattr(main, "response_cache", ResponseCache(max_bytes=1 << 20, ttl=60))
+    monkeypatch.setattr(main.bot_configs, "loader", load)
+    monkeypatch.setattr(main.admission, "rate", 0)
+    main.bot_configs._entries.clear()
+    main.bot_configs._negative.clear()
+    main.app.dependency_overrides[current_user] = lambda: {"id": "user-1"}
+    yield provider
+    main.app.dependency_overrides.clear()
+
+
+def _turn_in_new_conversation(bot_id: str) -> dict:
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            conversation = (await client.post("/chatbot/conversations", json={"bot_id": bot_id})).json()
+            response = await client.post(
+                "/chatbot/conversations/message",
+                json={"conversation_id": conversation["id"], "content": "¿qué tal?"},
+            )
+            assert response.status_code == 200, response.text
+            return response.json()
+
+    return asyncio.run(run())
+
+
+def test_conversation_turns_respect_bot_opt_out(api):
+    _turn_in_new_conversation("opted-out")
+    _turn_in_new_conversation("opted-out")
+    assert api.calls == 2
+    assert main.response_cache.hits == 0
+
+
+def test_deterministic_bot_turns_are_cached(api):
+    _turn_in_new_conversation("cached")
+    _turn_in_new_conversation("cached")
+    assert api.calls == 1
+    assert main.response_cache.hits == 1
+
+
+def test_conversation_turn_rejects_bot_settings(api):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            conversation = (await client.post("/chatbot/conversations", json={"bot_id": "cached"})).json()
+            return await client.post(
+                "/chatbot/conversations/message",
+                json={"conversation_id": conversation["id"], "content": "hola", "model": "otro"},
+            )
+
+    assert asyncio.run(run()).status_code == 422
+    assert api.calls == 0
+
+
+def test_conversation_turn_uses_bot_settings_and_history(api):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            conversation = (await client.post("/chatbot/conversations", json={"bot_id": "cached"})).json()
+            for content in ("primera", "segunda"):
+                response = await client.post(
+                    "/chatbot/conversations/message",
+                    json={"conversation_id": conversation["id"], "content": content},
+                )
+            history = await client.get(f"/chatbot/conversations/{conversation['id']}/messages")
+            return response.json(), [m["content"] for m in history.json()]
+
+    reply, history = asyncio.run(run())
+    assert reply["model_used"] == "m"
+    assert history == ["primera", "hola", "segunda", "hola"]
+
+
+def test_update_bot_checks_session_with_supabase():
+    route = next(r for r in main.app.routes if getattr(r, "path", "") == "/chatbot/bots/{bot_id}")
+    assert current_user_strict in [d.call for d in route.dependant.dependencies]
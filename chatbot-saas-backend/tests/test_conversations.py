@@ -0,0 +1,104 @@
+import asyncio
+
+from app.conversations import CachedConversationStore, SQLiteConversationStore
+from app.models import MessageCreate
+
+
+class CountingStore(SQLiteConversationStore):
+    """SQLite en memoria que apunta cuántas lecturas del historial llegan."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.history_calls = []
+
+    async def history(self, conversation_id, limit=None):
+        self.history_calls.append(limit)
+        return await super().history(conversation_id, limit)
+
+
+async def _conversation(store, messages: int) -> str:
+    conversation = await store.create_conversation("user-1", "bot-1")
+    for i in range(messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        await store.append(conversation.id, "user-1", MessageCreate(bot_id="bot-1", role=role, content=f"m{i}"))
+    return conversation.id
+
+
+def _contents(messages) -> list:
+    return [m.content for m in messages]
+
+
+def test_tail_loaded_from_long_conversation():
+    async def run():
+        backend = CountingStore()
+        conversation_id = await _conversation(backend, 25)
+        cached = CachedConversationStore(backend, tail_size=10)
+
+        assert await cached.count(conversation_id) == 25
+        assert _contents(await cached.history(conversation_id, limit=4)) == ["m21", "m22", "m23", "m24"]
+        assert _contents(await cached.history(conversation_id, limit=10)) == [f"m{i}" for i in range(15, 25)]
+        # Solo la carga de la cola llega al store
+        assert backend.history_calls == [10]
+
+        # Más de lo que hay en la cola: se lee del store
+        assert len(await cached.history(conversation_id)) == 25
+        assert backend.history_calls == [10, None]
+
+    asyncio.run(run())
+
+
+def test_short_conversation_is_served_from_tail():
+    async def run():
+        backend = CountingStore()
+        conversation_id = await _conversation(backend, 3)
+        cached = CachedConversationStore(backend, tail_size=10)
+
+        assert await cached.count(conversation_id) == 3
+        assert len(await cached.history(conversation_id)) == 3
+        assert backend.history_calls == [10]
+
+    asyncio.run(run())
+
+
+def test_append_keeps_total():
+    async def run():
+        backend = CountingStore()
+        conversation_id = await _conversation(backend, 12)
+        cached = CachedConversationStore(backend, tail_size=5)
+        assert await cached.count(conversation_id) == 12
+
+        for i in range(3):
+            await cached.append(conversation_id, "user-1", MessageCreate(bot_id="bot-1", role="user", content=f"n{i}"))
+        assert await cached.count(conversation_id) == 15
+        assert await backend.count(conversation_id) == 15
+        assert _contents(await cached.history(conversation_id, limit=5)) == ["m10", "m11", "n0", "n1", "n2"]
+
+        # Una conversación creada a través de la caché empieza en 0
+        fresh = await cached.create_conversation("user-1", "bot-1")
+        await cached.append(fresh.id, "user-1", MessageCreate(bot_id="bot-1", role="user", content="hola"))
+        assert await cached.count(fresh.id) == 1
+        assert _contents(await cached.history(fresh.id)) == ["hola"]
+
+    asyncio.run(run())
+
+
+def test_least_recent_conversations_are_evicted():
+    async def run():
+        backend = CountingStore()
+        ids = [await _conversation(backend, 2) for _ in range(3)]
+        cached = CachedConversationStore(backend, tail_size=10, max_conversations=2)
+
+        await cached.history(ids[0])
+        await cached.history(ids[1])
+        await cached.history(ids[0])  # ids[1] pasa a ser el menos reciente
+        await cached.history(ids[2])
+        assert list(cached._tails) == [ids[0], ids[2]]
+        assert backend.history_calls == [10, 10, 10]
+
+        # La expulsada se vuelve a cargar (con su resumen) desde el store
+        await backend.set_summary(ids[1], 2, "resumen")
+        assert await cached.get_summary(ids[1]) == (2, "resumen")
+        assert await cached.count(ids[1]) == 2
+        assert list(cached._tails) == [ids[2], ids[1]]
+
+    asyncio.run(run())
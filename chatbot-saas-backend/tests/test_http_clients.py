@@ -0,0 +1,53 @@
+from app import http_clients
+from app.http_clients import PoolMeter
+
+
+class FakeConnection:
+    def __init__(self, available: bool, idle: bool = False):
+        self.available = available
+        self.idle = idle
+
+    def is_available(self) -> bool:
+        return self.available
+
+    def is_idle(self) -> bool:
+        return self.idle
+
+
+class FakePool:
+    def __init__(self, *connections):
+        self.connections = list(connections)
+
+
+def test_multiplexed_connection_is_not_saturated():
+    # HTTP/2: una conexión con sitio para más streams
+    meter = PoolMeter(max_connections=1, pool=FakePool(FakeConnection(available=True)))
+    for _ in range(10):
+        meter.acquire()
+    stats = meter.stats()
+    assert stats["saturated"] == 0
+    assert stats["in_flight"] == 10
+    assert stats["connections_in_use"] == 1
+    assert stats["utilisation"] == 1.0
+
+
+def test_full_pool_counts_as_saturated():
+    pool = FakePool(FakeConnection(available=False), FakeConnection(available=False))
+    meter = PoolMeter(max_connections=2, pool=pool)
+    meter.acquire()
+    assert meter.stats()["saturated"] == 1
+
+    # Con una conexión libre ya no hay que esperar
+    pool.connections[1] = FakeConnection(available=True, idle=True)
+    meter.acquire()
+    stats = meter.stats()
+    assert stats["saturated"] == 1
+    assert stats["connections_in_use"] == 1
+    assert stats["utilisation"] == 0.5
+
+
+def test_clients_meter_their_transport_pool():
+    http_clients.get_client("supabase")
+    meter = http_clients._meters["supabase"]
+    assert meter.pool is not None
+    assert meter.stats()["connections"] == 0
@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+import pytest
+
+from app.providers import LatencyStats, MockProvider, NoProviderAvailable, ProviderError, Router
+
+PAYLOAD = {"model": "m", "messages": [{"role": "user", "content": "hola"}]}
+
+
+def _complete(router: Router, payload: dict = PAYLOAD) -> dict:
+    return asyncio.run(router.complete(payload))
+
+
+def test_fails_over_to_next_provider():
+    broken = MockProvider("broken", error_rate=1.0)
+    healthy = MockProvider("healthy", reply="ok")
+    router = Router([broken, healthy])
+
+    assert _complete(router)["reply"] == "ok"
+    assert broken.calls == 1 and healthy.calls == 1
+    assert router.stats()["backends"]["broken:m"]["error_rate"] == 1.0
+
+
+def test_all_providers_failing_raises_last_error():
+    router = Router([MockProvider("a", error_rate=1.0), MockProvider("b", error_rate=1.0)])
+    with pytest.raises(ProviderError):
+        _complete(router)
+
+
+def test_client_errors_do_not_fail_over():
+    class BadRequest(MockProvider):
+        async def complete(self, payload):
+            self.calls += 1
+            raise ValueError("payload inválido")
+
+    bad, other = BadRequest("bad"), MockProvider("other")
+    router = Router([bad, other])
+    with pytest.raises(ValueError):
+        _complete(router)
+    assert other.calls == 0
+    assert router.stats()["backends"]["bad:m"]["breaker"] == "closed"
+
+
+def test_unsupported_model_has_no_candidates():
+    router = Router([MockProvider("a", models=["otro"])])
+    with pytest.raises(NoProviderAvailable):
+        _complete(router)
+
+
+def test_breaker_opens_and_probes_after_cooldown():
+    flaky = MockProvider("flaky", error_rate=1.0)
+    backup = MockProvider("backup")
+    router = Router([flaky, backup], breaker_failures=2, breaker_cooldown=0.05)
+
+    _complete(router)
+    _complete(router)
+    assert router.stats()["backends"]["flaky:m"]["breaker"] == "open"
+
+    # Abierto: no se le manda tráfico
+    _complete(router)
+    assert flaky.calls == 2
+
+    # Pasado el cooldown, una petición de prueba; si sale bien se cierra
+    time.sleep(0.06)
+    assert router.stats()["backends"]["flaky:m"]["breaker"] == "half-open"
+    flaky.error_rate = 0.0
+    router._stats.clear()  # que la prueba vaya primero al ordenar por latencia
+    _complete(router)
+    assert flaky.calls == 3
+    assert router._breakers[("flaky", "m")].state == "closed"
+
+
+def test_failed_probe_reopens_breaker():
+    flaky = MockProvider("flaky", error_rate=1.0)
+    router = Router([flaky, MockProvider("backup")], breaker_failures=1, breaker_cooldown=0.05)
+
+    _complete(router)
+    time.sleep(0.06)
+    router._stats.clear()
+    _complete(router)
+    assert flaky.calls == 2
+    assert router._breakers[("flaky", "m")].state == "open"
+
+
+def test_candidates_prefer_faster_provider():
+    slow, fast = MockProvider("slow", latency=0.05), MockProvider("fast", latency=0.0)
+    router = Router([slow, fast])
+    router._stats_for(slow, "m").record(0.05, ok=True)
+    router._stats_for(fast, "m").record(0.001, ok=True)
+    assert [p.name for p in router.candidates("m")] == ["fast", "slow"]
+
+
+def test_hedge_returns_first_response():
+    slow = MockProvider("slow", reply="lento", latency=1.0)
+    fast = MockProvider("fast", reply="rápido", latency=0.01)
+    router = Router([slow, fast], hedging=True, hedge_default_delay=0.05)
+
+    start = time.perf_counter()
+    assert _complete(router)["reply"] == "rápido"
+    assert time.perf_counter() - start < 0.5
+    assert router.hedged == 1
+    assert slow.calls == 1 and fast.calls == 1
+
+
+def test_no_hedge_when_primary_is_fast():
+    primary, backup = MockProvider("primary", latency=0.0), MockProvider("backup")
+    router = Router([primary, backup], hedging=True, hedge_default_delay=0.5)
+    _complete(router)
+    assert router.hedged == 0 and backup.calls == 0
+
+
+def test_hedge_loser_is_censored_not_sampled():
+    slow = MockProvider("slow", reply="lento", latency=1.0)
+    fast = MockProvider("fast", reply="rápido", latency=0.01)
+    router = Router([slow, fast], hedging=True, hedge_default_delay=0.05)
+    _complete(router)
+
+    backend = router.stats()["backends"]["slow:m"]
+    assert backend["censored"] == 1
+    # Sin muestras completas, lo único que se sabe es la cota inferior
+    assert backend["p50"] >= 0.05
+    # Y el que tardó pasa detrás del que respondió
+    assert [p.name for p in router.candidates("m")] == ["fast", "slow"]
+
+
+def test_censored_samples_do_not_lower_quantiles():
+    stats = LatencyStats(window=10)
+    for _ in range(4):
+        stats.record(1.0, ok=True)
+    for _ in range(6):
+        stats.censor(0.15)
+    assert stats.quantile(0.5) == 1.0
+    assert stats.quantile(0.95) == 1.0
+    assert stats.censored == 6
+
+
+def test_candidates_do_not_create_state():
+    router = Router([MockProvider("a")])
+    for i in range(300):
+        router.candidates(f"modelo-{i}")
+    assert router.stats()["backends"] == {}
+    assert not router._breakers
+
+
+def test_backend_state_is_bounded():
+    router = Router([MockProvider("a")], max_backends=10)
+    for i in range(300):
+        _complete(router, {**PAYLOAD, "model": f"modelo-{i}"})
+    assert len(router.stats()["backends"]) == 10
+    assert len(router._breakers) == 10
+    assert "a:modelo-299" in router.stats()["backends"]
+
+
+def _stream(router: Router) -> list:
+    async def run():
+        return [event async for event in router.stream(PAYLOAD)]
+
+    return asyncio.run(run())
+
+
+def test_stream_records_time_to_first_chunk():
+    router = Router([MockProvider("a", reply="uno dos", latency=0.05)])
+    events = _stream(router)
+    assert [e.get("content") for e in events[:2]] == ["uno ", "dos "]
+
+    backend = router.stats()["backends"]["a:m"]
+    assert 0.05 <= backend["p50"] < 0.5
+    assert backend["error_rate"] == 0.0
+
+
+def test_streams_rank_providers():
+    slow = MockProvider("slow", latency=0.05)
+    fast = MockProvider("fast", latency=0.0)
+    router = Router([slow, fast])
+    # Sin datos se respeta el orden de configuración; luego manda la latencia
+    _stream(router)
+    _stream(router)
+    assert slow.calls == 1 and fast.calls == 1
+    assert [p.name for p in router.candidates("m")] == ["fast", "slow"]
@@ -0,0 +1,135 @@
+import asyncio
+import uuid
+
+from app.ratelimit import AdmissionController, FairLimiter, InMemoryBackend, RateLimited, bot_for, tenant_for
+
+REAL_BOT = str(uuid.uuid4())
+
+
+def _scope(bot_id: str = None, ip: str = "10.0.0.1") -> dict:
+    headers = [(b"x-bot-id", bot_id.encode())] if bot_id else []
+    return {"type": "http", "headers": headers, "client": (ip, 1234)}
+
+
+def _controller(lookups: list, **overrides) -> AdmissionController:
+    async def bot_exists(bot_id):
+        lookups.append(bot_id)
+        return bot_id == REAL_BOT
+
+    options = dict(
+        backend=InMemoryBackend(),
+        rate=0.001,
+        burst=2,
+        token_budget=0,
+        budget_window=60,
+        limiter=FairLimiter(100, 100, 100),
+        queue_timeout=1,
+        bot_rate=0.001,
+        bot_burst=3,
+        bot_exists=bot_exists,
+    )
+    options.update(overrides)
+    return AdmissionController(**options)
+
+
+def _admitted(controller: AdmissionController, requests) -> list:
+    """Intenta admitir cada (tenant, bot_id); True si pasa."""
+    async def run():
+        results = []
+        for tenant, bot_id in requests:
+            try:
+                await controller.admit(tenant, bot_id)
+            except RateLimited:
+                results.append(False)
+            else:
+                controller.release(tenant)
+                results.append(True)
+        return results
+
+    return asyncio.run(run())
+
+
+def test_tenant_ignores_bot_header():
+    assert asyncio.run(tenant_for(_scope(REAL_BOT))) == "ip:10.0.0.1"
+
+
+def test_bot_header_must_be_a_uuid():
+    assert bot_for(_scope(REAL_BOT.upper())) == REAL_BOT
+    assert bot_for(_scope("not-a-uuid")) is None
+    assert bot_for(_scope()) is None
+
+
+def test_switching_bots_does_not_reset_ip_bucket():
+    lookups = []
+    controller = _controller(lookups)
+    requests = [("ip:a", str(uuid.uuid4())) for _ in range(5)]
+    assert _admitted(controller, requests) == [True, True, False, False, False]
+    # Los rechazados por IP no llegan a consultar el bot
+    assert len(lookups) == 2
+
+
+def test_bot_limit_applies_across_ips():
+    controller = _controller([])
+    requests = [(f"ip:{i}", REAL_BOT) for i in range(5)]
+    assert _admitted(controller, requests) == [True, True, True, False, False]
+
+
+def test_unknown_bots_have_no_bucket():
+    controller = _controller([])
+    requests = [(f"ip:{i}", str(uuid.uuid4())) for i in range(5)]
+    assert all(_admitted(controller, requests))
+
+
+def test_bot_lookup_errors_only_skip_the_bot_limit():
+    async def broken(bot_id):
+        raise RuntimeError("supabase caído")
+
+    controller = _controller([], bot_exists=broken)
+    assert _admitted(controller, [("ip:a", REAL_BOT)]) == [True]
+
+
+def test_bucket_limits_and_refills():
+    async def run():
+        backend = InMemoryBackend()
+        assert await backend.take("k", 1, 2) == 0
+        assert await backend.take("k", 1, 2) == 0
+        assert await backend.take("k", 1, 2) > 0
+
+    asyncio.run(run())
+
+
+def test_full_buckets_are_evicted():
+    async def run():
+        backend = InMemoryBackend()
+        for i in range(100):
+            await backend.take(f"k{i}", 1000, 2)
+        await asyncio.sleep(0.01)
+        await backend.take("last", 1000, 2)
+        return list(backend._buckets)
+
+    assert asyncio.run(run()) == ["last"]
+
+
+def test_bucket_count_is_capped():
+    async def run():
+        backend = InMemoryBackend(max_keys=10)
+        for i in range(100):
+            await backend.take(f"k{i}", 0.001, 2)
+        return backend._buckets
+
+    buckets = asyncio.run(run())
+    assert len(buckets) == 10
+    assert "k99" in buckets
+
+
+def test_expired_spend_windows_are_evicted():
+    async def run():
+        backend = InMemoryBackend()
+        for i in range(100):
+            await backend.spend(f"s{i}", 5, 0.01)
+        await asyncio.sleep(0.02)
+        await backend.spend("last", 5, 0.01)
+        assert list(backend._spend) == ["last"]
+        assert (await backend.spent("last", 0.01))[0] == 5
+
+    asyncio.run(run())
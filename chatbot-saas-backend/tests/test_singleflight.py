@@ -0,0 +1,150 @@
+import asyncio
+
+from app.singleflight import SingleFlight
+
+
+class Upstream:
+    """
+    Streams falsos: cada uno emite los chunks que se mandan a su cola
+    (`queues[i]` para el i-ésimo abierto) y se apunta si lo cancelan.
+    """
+
+    def __init__(self):
+        self.queues: list = []
+        self.cancelled = 0
+
+    @property
+    def opened(self) -> int:
+        return len(self.queues)
+
+    async def stream(self):
+        chunks: asyncio.Queue = asyncio.Queue()
+        self.queues.append(chunks)
+        try:
+            while True:
+                yield await chunks.get()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_follower_gets_result_when_leader_is_cancelled():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "respuesta"
+
+        leader = asyncio.create_task(flight.do("k", fetch))
+        await _settle()
+        follower = asyncio.create_task(flight.do("k", fetch))
+        await _settle()
+        leader.cancel()
+        await _settle()
+        release.set()
+
+        assert await follower == "respuesta"
+        assert leader.cancelled()
+        assert calls == 1 and flight.shared == 1
+
+    asyncio.run(run())
+
+
+def test_call_is_cancelled_when_nobody_waits():
+    async def run():
+        flight = SingleFlight()
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def fetch():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.create_task(flight.do("k", fetch))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def run():
+        flight = SingleFlight()
+        upstream = Upstream()
+        first = flight.do_stream("k", upstream.stream)
+        second = flight.do_stream("k", upstream.stream)
+        reads = [asyncio.create_task(first.__anext__()), asyncio.create_task(second.__anext__())]
+        await _settle()
+        await upstream.queues[0].put("hola")
+        assert await asyncio.gather(*reads) == ["hola", "hola"]
+        assert upstream.opened == 1
+
+        await first.aclose()
+        await _settle()
+        assert upstream.cancelled == 0
+
+        await second.aclose()
+        await _settle()
+        assert upstream.cancelled == 1
+
+    asyncio.run(run())
+
+
+def test_late_request_opens_its_own_stream():
+    async def run():
+        flight = SingleFlight()
+        upstream = Upstream()
+        early = flight.do_stream("k", upstream.stream)
+        read = asyncio.create_task(early.__anext__())
+        await _settle()
+        await upstream.queues[0].put("primero")
+        assert await read == "primero"
+
+        # Ya ha salido un chunk: el que llega ahora no se une al stream en curso
+        late = flight.do_stream("k", upstream.stream)
+        read = asyncio.create_task(late.__anext__())
+        await _settle()
+        assert upstream.opened == 2
+        assert flight.shared == 0
+
+        await upstream.queues[0].put("temprano")
+        await upstream.queues[1].put("tardío")
+        assert await early.__anext__() == "temprano"
+        assert await read == "tardío"
+        await early.aclose()
+        await late.aclose()
+
+    asyncio.run(run())
+
+
+def test_stream_errors_reach_every_subscriber():
+    async def run():
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream caído")
+            yield  # pragma: no cover
+
+        async def consume():
+            return [chunk async for chunk in flight.do_stream("k", failing)]
+
+        results = await asyncio.gather(consume(), consume(), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(run())